@@ -0,0 +1,114 @@
+import time
+from datetime import datetime
+from sqlalchemy import delete, update
+from dashboard import user_admin_filter, user_prefix_filter
+from extensions import db
+from model import Post, User
+from search import remove_posts_by_authors
+
+# Actions accepted by run_bulk_action
+BULK_ACTIONS = ('promote', 'demote', 'delete')
+
+# Filters accepted by run_bulk_action, with the type each value must have
+BULK_FILTERS = {'prefix': str, 'is_admin': bool, 'joined_before': str}
+
+
+# Raised for a bulk request that names no users, or has an unknown action or a malformed filter or id list
+class BulkActionError(ValueError):
+    pass
+
+
+# Yield the matching user ids in ascending chunks, either from an explicit id list or from a filter.
+# Filters: username/email prefix, is_admin, joined_before.
+def _id_chunks(ids, filters, chunk_size, exclude_id):
+    if ids is not None:
+        ids = sorted({int(user_id) for user_id in ids} - {exclude_id})
+        for start in range(0, len(ids), chunk_size):
+            yield ids[start:start + chunk_size]
+        return
+
+    query = db.session.query(User.id)
+    prefix = filters.get('prefix')
+    if prefix:
+        query = query.filter(user_prefix_filter(prefix))
+    if filters.get('is_admin') is not None:
+        query = query.filter(user_admin_filter(filters['is_admin']))
+    if filters.get('joined_before'):
+        query = query.filter(User.date_joined < filters['joined_before'])
+    if exclude_id is not None:
+        query = query.filter(User.id != exclude_id)
+
+    # Keyset over the primary key, so rows deleted by earlier chunks don't shift later ones
+    last_id = 0
+    while True:
+        chunk = [row.id for row in query.filter(User.id > last_id).order_by(User.id).limit(chunk_size)]
+        if not chunk:
+            return
+        yield chunk
+        last_id = chunk[-1]
+
+
+# Promote, demote or delete many users with set-based UPDATE/DELETE ... WHERE id IN statements,
+# one transaction per chunk. Deleting a user deletes their posts (and search entries) the same way.
+# on_chunk(user_ids, post_ids) is called after each committed chunk, e.g. to invalidate caches.
+# exclude_id (normally the acting admin) is never touched. Returns a summary of what was done.
+def run_bulk_action(action, ids=None, filters=None, chunk_size=500, exclude_id=None, on_chunk=None):
+    if action not in BULK_ACTIONS:
+        raise BulkActionError(f"Unknown bulk action: {action!r}")
+    if not isinstance(filters or {}, dict):
+        raise BulkActionError('The filter must be an object.')
+    unknown = set(filters or {}) - set(BULK_FILTERS)
+    if unknown:
+        # An unrecognised filter must not silently widen the action to every user
+        raise BulkActionError(f"Unknown filter: {', '.join(sorted(unknown))}")
+    filters = {key: value for key, value in (filters or {}).items() if value is not None and value != ''}
+    for key, value in filters.items():
+        # JSON "false" or 0 would otherwise be read as true, and a number as a prefix fails deep in the query
+        if type(value) is not BULK_FILTERS[key]:
+            raise BulkActionError(f"The {key} filter must be a {BULK_FILTERS[key].__name__}.")
+    if 'joined_before' in filters:
+        try:
+            filters['joined_before'] = datetime.fromisoformat(filters['joined_before'])
+        except ValueError:
+            raise BulkActionError('joined_before must be an ISO 8601 date.')
+    if ids is not None:
+        if not isinstance(ids, (list, tuple)):
+            raise BulkActionError('ids must be a list of user ids.')
+        try:
+            ids = [int(user_id) for user_id in ids]
+        except (TypeError, ValueError):
+            raise BulkActionError('ids must be a list of user ids.')
+    if ids is None and not filters:
+        raise BulkActionError('A bulk action needs a list of user ids or at least one filter.')
+
+    started = time.perf_counter()
+    summary = {'action': action, 'matched': 0, 'users_affected': 0, 'posts_deleted': 0, 'chunks': 0}
+    for chunk in _id_chunks(ids, filters, chunk_size, exclude_id):
+        post_ids = []
+        if action == 'delete':
+            # Only kept for on_chunk; the deletes select the posts by author in the database
+            post_ids = [row.id for row in db.session.query(Post.id).filter(Post.user_id.in_(chunk))]
+            remove_posts_by_authors(db.session.connection(), chunk)
+            result = db.session.execute(
+                delete(Post).where(Post.user_id.in_(chunk)), execution_options={'synchronize_session': False}
+            )
+            summary['posts_deleted'] += result.rowcount
+            result = db.session.execute(
+                delete(User).where(User.id.in_(chunk)), execution_options={'synchronize_session': False}
+            )
+        else:
+            result = db.session.execute(
+                update(User).where(User.id.in_(chunk)).values(is_admin=(action == 'promote')),
+                execution_options={'synchronize_session': False},
+            )
+        db.session.commit()
+        summary['matched'] += len(chunk)
+        summary['users_affected'] += result.rowcount
+        summary['chunks'] += 1
+        if on_chunk:
+            on_chunk(chunk, post_ids)
+
+    # Objects loaded earlier in this session may describe rows that have just changed
+    db.session.expire_all()
+    summary['elapsed_ms'] = round((time.perf_counter() - started) * 1000, 1)
+    return summary
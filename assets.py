@@ -0,0 +1,296 @@
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import re
+import tempfile
+import threading
+import click
+from flask import abort, current_app, request, send_file
+from flask.cli import AppGroup
+from werkzeug.security import safe_join
+
+try:
+    import brotli  # Optional: adds .br variants next to the .gz ones
+except ImportError:
+    brotli = None
+
+# Bundles served to browsers and the source files (relative to assets/) they are built from, in order.
+# Only the Bootstrap JavaScript the templates use is shipped: the navbar collapse needs jQuery, and nothing uses
+# the Popper-based dropdowns or tooltips.
+BUNDLES = {
+    'site.css': ['vendor/bootstrap.min.css', 'css/style.css'],
+    'site.js': ['vendor/jquery.min.js', 'vendor/bootstrap.min.js'],
+}
+
+# CSS classes kept even though they don't appear literally in the templates:
+# alert-<category> is built from flash categories, and the collapse plugin toggles the others at runtime.
+CSS_SAFELIST = re.compile(r'^(alert-[\w-]+|show|collapse|collapsing|collapsed|active|disabled|fade)$')
+
+MANIFEST_NAME = 'manifest.json'
+
+# Files smaller than this aren't worth precompressing
+MIN_COMPRESS_SIZE = 256
+
+# Far-future caching is safe because every built file name contains a hash of its content
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+
+_STRING = re.compile(r'"(?:\\.|[^"\\])*"|\'(?:\\.|[^\'\\])*\'')
+
+
+# Minify CSS: drop comments and whitespace, leaving strings and /*! license */ comments untouched
+def minify_css(css):
+    parts = []
+    position = 0
+    for match in re.finditer(rf'{_STRING.pattern}|/\*!.*?\*/', css, flags=re.S):
+        parts.append(_minify_css_code(css[position:match.start()]))
+        parts.append(match.group(0))
+        position = match.end()
+    parts.append(_minify_css_code(css[position:]))
+    return ''.join(parts).strip()
+
+
+def _minify_css_code(code):
+    code = re.sub(r'/\*(?!!).*?\*/', '', code, flags=re.S)
+    code = re.sub(r'\s+', ' ', code)
+    # Spaces before ':' are kept, as in a selector they mean a descendant (`.nav :focus`)
+    code = re.sub(r'\s*([{};,>])\s*', r'\1', code)
+    code = re.sub(r':\s+', ':', code)
+    return code.replace(';}', '}')
+
+
+# Split CSS into top-level (prelude, body) pairs; statements without a block, such as @import, have body None
+def _css_blocks(css):
+    blocks = []
+    depth = 0
+    start = 0
+    prelude = None
+    index = 0
+    while index < len(css):
+        char = css[index]
+        if char in '"\'':
+            index = _STRING.match(css, index).end()
+            continue
+        if css.startswith('/*', index):
+            index = css.index('*/', index) + 2
+            continue
+        if char == '{':
+            if depth == 0:
+                prelude = css[start:index]
+                start = index + 1
+            depth += 1
+        elif char == '}':
+            depth -= 1
+            if depth == 0:
+                blocks.append((prelude.strip(), css[start:index]))
+                start = index + 1
+        elif char == ';' and depth == 0:
+            blocks.append((css[start:index].strip(), None))
+            start = index + 1
+        index += 1
+    return blocks
+
+
+# Split a selector list on the commas that aren't inside parentheses
+def _split_selectors(selectors):
+    parts, depth, start = [], 0, 0
+    for index, char in enumerate(selectors):
+        if char == '(':
+            depth += 1
+        elif char == ')':
+            depth -= 1
+        elif char == ',' and depth == 0:
+            parts.append(selectors[start:index])
+            start = index + 1
+    parts.append(selectors[start:])
+    return parts
+
+
+# Drop style rules whose selectors all name a class that no template uses
+def purge_css(css, used_classes):
+    def keep(selector):
+        classes = re.findall(r'\.(-?[_a-zA-Z][\w-]*)', re.sub(r'\[[^\]]*\]', '', selector))
+        return all(name in used_classes or CSS_SAFELIST.match(name) for name in classes)
+
+    output = []
+    for prelude, body in _css_blocks(css):
+        # License comments stay, whatever happens to the rule that follows them
+        comments, prelude = re.match(r'((?:/\*.*?\*/\s*)*)(.*)', prelude, re.S).groups()
+        output.append(comments.strip())
+        if body is None:
+            output.append(prelude + ';')
+        elif prelude.startswith(('@media', '@supports')):
+            inner = purge_css(body, used_classes)
+            if inner:
+                output.append(f"{prelude}{{{inner}}}")
+        elif prelude.startswith('@'):
+            output.append(f"{prelude}{{{body}}}")  # @font-face, @keyframes, @page: kept as they are
+        else:
+            selectors = [selector for selector in _split_selectors(prelude) if keep(selector)]
+            if selectors:
+                output.append(f"{','.join(selectors)}{{{body}}}")
+    return ''.join(output)
+
+
+# Every word appearing in the templates, a superset of the CSS classes they use
+def template_words(template_folder):
+    words = set()
+    for root, dirs, files in os.walk(template_folder):
+        for name in files:
+            with open(os.path.join(root, name), encoding='utf-8') as template:
+                words.update(re.findall(r'[\w-]+', template.read()))
+    return words
+
+
+def _write(path, data):
+    handle, temporary = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.tmp-')
+    with os.fdopen(handle, 'wb') as output:
+        output.write(data)
+    os.chmod(temporary, 0o644)
+    os.replace(temporary, path)
+
+
+# Build every bundle into static/dist: minified, named by content hash, with .gz (and .br) variants and a manifest
+# mapping bundle names to built file names. Files from the previous build are kept for pages still linking to them.
+def build_assets(app):
+    source_folder = os.path.join(app.root_path, 'assets')
+    output_folder = os.path.join(app.static_folder, 'dist')
+    os.makedirs(output_folder, exist_ok=True)
+    used_classes = template_words(os.path.join(app.root_path, app.template_folder))
+
+    manifest = {}
+    for bundle, sources in BUNDLES.items():
+        contents = []
+        for source in sources:
+            with open(os.path.join(source_folder, source), encoding='utf-8') as source_file:
+                # Source maps aren't shipped, so drop the comments pointing at them
+                contents.append(re.sub(r'^\s*(//[#@]|/\*[#@]) sourceMappingURL=.*$', '', source_file.read(), flags=re.M))
+        stem, extension = os.path.splitext(bundle)
+        if extension == '.css':
+            css = minify_css('\n'.join(contents))
+            # @import only works at the top of a stylesheet, so hoist any from the later files
+            blocks = _css_blocks(css)
+            imports = ''.join(prelude + ';' for prelude, body in blocks if body is None and prelude.startswith('@import'))
+            rest = ''.join(
+                f"{prelude}{{{body}}}" if body is not None else ('' if prelude.startswith('@import') else prelude + ';')
+                for prelude, body in blocks
+            )
+            data = (imports + purge_css(rest, used_classes)).encode('utf-8')
+        else:
+            # Vendor scripts are already minified upstream; they are only concatenated
+            data = ';\n'.join(content.strip() for content in contents).encode('utf-8')
+
+        name = f"{stem}.{hashlib.sha256(data).hexdigest()[:12]}{extension}"
+        path = os.path.join(output_folder, name)
+        if not os.path.exists(path):
+            _write(path, data)
+            if len(data) >= MIN_COMPRESS_SIZE:
+                _write(path + '.gz', gzip.compress(data, compresslevel=9, mtime=0))
+                if brotli is not None:
+                    _write(path + '.br', brotli.compress(data, quality=11))
+        manifest[bundle] = name
+
+    manifest_path = os.path.join(output_folder, MANIFEST_NAME)
+    previous = {}
+    if os.path.exists(manifest_path):
+        with open(manifest_path, encoding='utf-8') as manifest_file:
+            previous = json.load(manifest_file).get('bundles', {})
+    keep = set(manifest.values()) | set(previous.values()) | {MANIFEST_NAME}
+    for name in os.listdir(output_folder):
+        built_name = name[:-3] if name.endswith(('.gz', '.br')) else name
+        if built_name not in keep and not name.startswith('.tmp-'):
+            os.remove(os.path.join(output_folder, name))
+    _write(manifest_path, json.dumps({'bundles': manifest, 'previous': previous}, indent=2).encode('utf-8'))
+    return manifest
+
+
+# Serves the built bundles and provides asset_url() to templates.
+# asset_url('site.css') looks the bundle up in static/dist/manifest.json and returns the content-hashed URL.
+# If the bundles haven't been built yet (`flask assets build`) they are built on first use; in debug mode they
+# are also rebuilt whenever a source file or template changes.
+# Built files are served from /static/dist with Cache-Control: immutable, choosing the .br or .gz variant the
+# client accepts.
+class Assets:
+    def __init__(self, app=None):
+        self._lock = threading.Lock()
+        self._manifest = None
+        self._built_at = 0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.extensions['assets'] = self
+        app.add_template_global(self.url, 'asset_url')
+        app.add_url_rule(f"{app.static_url_path}/dist/<path:filename>", 'assets', self._serve)
+
+    def _newest_source(self, app):
+        newest = 0
+        for folder in (os.path.join(app.root_path, 'assets'), os.path.join(app.root_path, app.template_folder)):
+            for root, dirs, files in os.walk(folder):
+                for name in files:
+                    newest = max(newest, os.stat(os.path.join(root, name)).st_mtime)
+        return newest
+
+    # The bundle -> built file name mapping, building the bundles if needed
+    def manifest(self, app=None):
+        app = app or current_app._get_current_object()
+        with self._lock:
+            if self._manifest is not None and not (app.debug and self._newest_source(app) > self._built_at):
+                return self._manifest
+            manifest_path = os.path.join(app.static_folder, 'dist', MANIFEST_NAME)
+            stale = not os.path.exists(manifest_path)
+            if not stale and app.debug:
+                stale = self._newest_source(app) > os.stat(manifest_path).st_mtime
+            if stale:
+                app.logger.info('Building asset bundles into %s', os.path.dirname(manifest_path))
+                build_assets(app)
+            with open(manifest_path, encoding='utf-8') as manifest_file:
+                self._manifest = json.load(manifest_file)['bundles']
+            self._built_at = os.stat(manifest_path).st_mtime
+            return self._manifest
+
+    def url(self, bundle):
+        return f"{current_app.static_url_path}/dist/{self.manifest()[bundle]}"
+
+    def _serve(self, filename):
+        path = safe_join(os.path.join(current_app.static_folder, 'dist'), filename)
+        if path is None or not os.path.isfile(path):
+            abort(404)
+        mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+        encoding = None
+        for candidate, suffix in (('br', '.br'), ('gzip', '.gz')):
+            if request.accept_encodings[candidate] and os.path.isfile(path + suffix):
+                encoding, path = candidate, path + suffix
+                break
+        hashed = filename != MANIFEST_NAME
+        # download_name keeps Content-Disposition on the requested name rather than the .br/.gz file's
+        response = send_file(
+            path, mimetype=mimetype, conditional=True, download_name=os.path.basename(filename),
+            max_age=IMMUTABLE_MAX_AGE if hashed else None,
+        )
+        if encoding:
+            response.headers['Content-Encoding'] = encoding
+        response.vary.add('Accept-Encoding')
+        if hashed:
+            response.cache_control.immutable = True
+        return response
+
+
+assets = Assets()
+
+
+# `flask assets ...` commands
+assets_cli = AppGroup('assets', help='Build the CSS and JavaScript bundles.')
+
+
+@assets_cli.command('build')
+def build_command():
+    app = current_app._get_current_object()
+    for bundle, name in build_assets(app).items():
+        path = os.path.join(app.static_folder, 'dist', name)
+        sizes = [f"{os.path.getsize(path)} bytes"]
+        for suffix in ('.gz', '.br'):
+            if os.path.exists(path + suffix):
+                sizes.append(f"{suffix[1:]} {os.path.getsize(path + suffix)}")
+        click.echo(f"{bundle} -> {name} ({', '.join(sizes)})")
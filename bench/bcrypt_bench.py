@@ -0,0 +1,44 @@
+# Micro-benchmark: password verifications (logins) per second through the hashing pool at each bcrypt cost.
+#
+#   python bench/bcrypt_bench.py --costs 10 11 12 13 --logins 64 --concurrency 8
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from hashing import PasswordHasher  # noqa: E402
+
+
+def run(cost, logins, concurrency, workers, executor):
+    hasher = PasswordHasher()
+    hasher.configure(rounds=cost, workers=workers, max_pending=max(concurrency, workers or 1), executor=executor)
+    pw_hash = hasher.hash('correct horse battery staple')
+    # Simulate concurrent request threads all verifying passwords through the shared pool
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as clients:
+        results = list(clients.map(lambda _: hasher.check(pw_hash, 'correct horse battery staple'), range(logins)))
+    elapsed = time.perf_counter() - started
+    hasher.shutdown()
+    assert all(results)
+    return logins / elapsed, elapsed / logins * concurrency
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--costs', type=int, nargs='+', default=[10, 11, 12, 13])
+    parser.add_argument('--logins', type=int, default=32)
+    parser.add_argument('--concurrency', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--workers', type=int, default=None, help='hashing pool size (default: CPU count)')
+    parser.add_argument('--executor', choices=['thread', 'process'], default='thread')
+    args = parser.parse_args()
+
+    print(f"{'cost':>4}  {'logins/sec':>10}  {'latency ms':>10}")
+    for cost in args.costs:
+        rate, latency = run(cost, args.logins, args.concurrency, args.workers, args.executor)
+        print(f"{cost:>4}  {rate:>10.1f}  {latency * 1000:>10.1f}")
+
+
+if __name__ == '__main__':
+    main()
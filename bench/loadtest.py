@@ -0,0 +1,504 @@
+# Load test for the blog's hot routes: home, post/<id>, login, new_post and admin_dashboard.
+#
+#   python bench/loadtest.py --output bench/baseline.json          # record a baseline
+#   python bench/loadtest.py --compare bench/baseline.json         # run again and diff against it
+#
+# The database is seeded once per (users, posts, seed, bcrypt cost, schema) by bench/seed.py and kept in
+# --data-dir; each run works on a fresh copy, so runs that create posts don't drift apart. Every scenario is driven twice:
+# - client: in this process through the Flask test client (no network, shows the app's own cost)
+# - server: over HTTP against `python -m serve` with several gunicorn workers
+# For each scenario it reports p50/p95/p99 latency, req/s, SQL statements per request (from the /metrics
+# endpoint, diffed around the scenario) and peak RSS. Server-side query counts are per worker process, so they
+# are only collected with --workers 1.
+#
+# Requests never follow redirects and logged-in scenarios reuse the cookie from their login, so each timed
+# request is exactly one round trip through the route being measured.
+import argparse
+import hashlib
+import http.client
+import json
+import os
+import random
+import re
+import resource
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+from urllib.parse import urlencode
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from seed import ADMIN_EMAIL, BENCH_PASSWORD  # noqa: E402
+
+SCENARIOS = ('home', 'post', 'login', 'new_post', 'admin_dashboard')
+
+# Endpoint label each scenario is recorded under in /metrics
+ENDPOINTS = {
+    'home': 'blog.home',
+    'post': 'blog.post',
+    'login': 'blog.login',
+    'new_post': 'blog.new_post',
+    'admin_dashboard': 'blog.admin_dashboard',
+}
+
+
+# In-process client: the Flask test client without its cookie jar, so cookies are passed explicitly
+class TestClient:
+    def __init__(self, app):
+        self.client = app.test_client(use_cookies=False)
+
+    def request(self, method, path, data=None, cookie=None):
+        headers = {'Cookie': cookie} if cookie else {}
+        response = self.client.open(path, method=method, data=data, headers=headers)
+        text = response.get_data(as_text=True)  # Drains streamed responses such as the admin dashboard
+        response.close()
+        return response.status_code, response.headers.getlist('Set-Cookie'), text
+
+    def close(self):
+        pass
+
+
+# HTTP client over one keep-alive connection, reconnecting if the server closes it
+class HTTPClient:
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self.connection = None
+
+    def request(self, method, path, data=None, cookie=None):
+        headers = {'Cookie': cookie} if cookie else {}
+        body = None
+        if data is not None:
+            body = urlencode(data)
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+        for attempt in range(2):
+            if self.connection is None:
+                self.connection = http.client.HTTPConnection(self.host, self.port, timeout=60)
+            try:
+                self.connection.request(method, path, body=body, headers=headers)
+                response = self.connection.getresponse()
+                text = response.read().decode('utf-8', 'replace')
+                if response.getheader('Connection', '').lower() == 'close':
+                    self.close()
+                return response.status, response.msg.get_all('Set-Cookie') or [], text
+            except (http.client.HTTPException, ConnectionError):
+                self.close()
+                if attempt:
+                    raise
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+
+# Log in through the login form and return the session cookie ('session=...') to send with later requests
+def login(client, email):
+    status, cookies, _ = client.request('POST', '/login', {'email': email, 'password': BENCH_PASSWORD})
+    for cookie in cookies:
+        if cookie.startswith('session='):
+            return cookie.split(';', 1)[0]
+    raise RuntimeError(f"Login as {email} failed with status {status}")
+
+
+# Builds the next request for a scenario; one per worker thread, each with its own random stream and session
+class Scenario:
+    def __init__(self, name, client, dataset, seed_value):
+        self.name = name
+        self.client = client
+        self.dataset = dataset
+        self.rng = random.Random(seed_value)
+        self.cookie = None
+        if name == 'new_post':
+            self.cookie = login(client, self._user_email())
+        elif name == 'admin_dashboard':
+            self.cookie = login(client, ADMIN_EMAIL)
+
+    def _user_email(self):
+        return f"user{self.rng.randint(1, self.dataset['users'] - 1):07d}@example.com"
+
+    def run_once(self):
+        if self.name == 'home':
+            return self.client.request('GET', '/')
+        if self.name == 'post':
+            post_id = self.rng.randint(self.dataset['min_post_id'], self.dataset['max_post_id'])
+            return self.client.request('GET', f"/post/{post_id}")
+        if self.name == 'login':
+            return self.client.request('POST', '/login', {'email': self._user_email(), 'password': BENCH_PASSWORD})
+        if self.name == 'new_post':
+            data = {'title': f"Benchmark post {self.rng.getrandbits(32):08x}", 'content': 'Lorem ipsum dolor sit amet. ' * 20}
+            return self.client.request('POST', '/post/new', data, self.cookie)
+        params = {'q': f"user{self.rng.randint(0, 9)}"} if self.rng.random() < 0.5 else {}
+        return self.client.request('GET', '/admin_dashboard' + (f"?{urlencode(params)}" if params else ''), cookie=self.cookie)
+
+
+# Resident set size (bytes) of the given processes and all of their descendants, from /proc (Linux only)
+def tree_rss(pids):
+    total = 0
+    seen = set()
+    pending = list(pids)
+    while pending:
+        pid = pending.pop()
+        if pid in seen:
+            continue
+        seen.add(pid)
+        try:
+            with open(f"/proc/{pid}/status") as status:
+                for line in status:
+                    if line.startswith('VmRSS:'):
+                        total += int(line.split()[1]) * 1024
+            for task in os.listdir(f"/proc/{pid}/task"):
+                with open(f"/proc/{pid}/task/{task}/children") as children:
+                    pending.extend(int(child) for child in children.read().split())
+        except (FileNotFoundError, ProcessLookupError, PermissionError):
+            continue
+    return total
+
+
+# Samples the RSS of a process tree in the background and keeps the peak
+class RSSSampler:
+    def __init__(self, pids, interval=0.1):
+        self.pids = pids
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.peak = max(self.peak, tree_rss(self.pids))
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, tree_rss(self.pids))
+
+
+# Parse the Prometheus text from /metrics into {(name, labels): value}
+def parse_metrics(text):
+    values = {}
+    for line in text.splitlines():
+        match = re.match(r'^([a-zA-Z_:][\w:]*)(?:\{(.*)\})?\s+(\S+)$', line)
+        if match:
+            values[(match.group(1), match.group(2) or '')] = float(match.group(3))
+    return values
+
+
+def scrape_metrics(client):
+    token = os.environ.get('METRICS_TOKEN')
+    if isinstance(client, HTTPClient):
+        client.close()  # A fresh connection, so the scrape doesn't queue behind a busy keep-alive
+    if token:
+        # Neither client takes arbitrary headers, so the token is only supported through the test client
+        if not isinstance(client, TestClient):
+            return None
+        response = client.client.get('/metrics', headers={'Authorization': f"Bearer {token}"})
+        return parse_metrics(response.get_data(as_text=True)) if response.status_code == 200 else None
+    status, _, text = client.request('GET', '/metrics')
+    return parse_metrics(text) if status == 200 else None
+
+
+# Average SQL statements per request for an endpoint between two /metrics scrapes
+def queries_per_request(before, after, endpoint):
+    if before is None or after is None:
+        return None
+    labels = f'endpoint="{endpoint}"'
+    count = after.get(('db_queries_per_request_count', labels), 0) - before.get(('db_queries_per_request_count', labels), 0)
+    total = after.get(('db_queries_per_request_sum', labels), 0) - before.get(('db_queries_per_request_sum', labels), 0)
+    return round(total / count, 2) if count else None
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, int(round(fraction * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+
+# Run one scenario with `concurrency` threads until `requests` timed requests have been made, after a warmup
+def run_scenario(name, make_client, dataset, requests, concurrency, warmup, seed_value, rss_pids):
+    clients = [make_client() for _ in range(concurrency)]
+    scenarios = [Scenario(name, client, dataset, seed_value * 1000 + index) for index, client in enumerate(clients)]
+    for index in range(warmup):
+        scenarios[index % concurrency].run_once()
+
+    metrics_client = make_client()
+    before = scrape_metrics(metrics_client)
+    latencies = []
+    statuses = {}
+    lock = threading.Lock()
+    remaining = [requests]
+
+    def worker(scenario):
+        while True:
+            with lock:
+                if remaining[0] <= 0:
+                    return
+                remaining[0] -= 1
+            started = time.perf_counter()
+            try:
+                status = scenario.run_once()[0]
+            except Exception as error:  # Counted as an error rather than aborting the whole run
+                status = type(error).__name__
+            elapsed = time.perf_counter() - started
+            with lock:
+                latencies.append(elapsed * 1000)
+                statuses[status] = statuses.get(status, 0) + 1
+
+    threads = [threading.Thread(target=worker, args=(scenario,)) for scenario in scenarios]
+    with RSSSampler(rss_pids) as sampler:
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        wall = time.perf_counter() - started
+    after = scrape_metrics(metrics_client)
+    for client in clients + [metrics_client]:
+        client.close()
+
+    latencies.sort()
+    expected = {'login': 302, 'new_post': 302}.get(name, 200)
+    return {
+        'requests': len(latencies),
+        'errors': sum(count for status, count in statuses.items() if status != expected),
+        'statuses': {str(status): count for status, count in sorted(statuses.items(), key=str)},
+        'p50_ms': round(percentile(latencies, 0.50), 2),
+        'p95_ms': round(percentile(latencies, 0.95), 2),
+        'p99_ms': round(percentile(latencies, 0.99), 2),
+        'mean_ms': round(statistics.fmean(latencies), 2),
+        'req_per_s': round(len(latencies) / wall, 1),
+        'queries_per_request': queries_per_request(before, after, ENDPOINTS[name]),
+        'peak_rss_mb': round(sampler.peak / 2 ** 20, 1) if sampler.peak else None,
+    }
+
+
+# Seed (or reuse) the pristine database for these volumes and return a working copy for this run
+def prepare_database(args, workdir):
+    os.makedirs(args.data_dir, exist_ok=True)
+    # The seeded password hashes use the configured bcrypt cost, and the file must match the current schema and
+    # seeding code, so both are part of the key too
+    rounds = os.environ.get('BCRYPT_LOG_ROUNDS', 'default')
+    schema = hashlib.sha1()
+    for path in ('model.py', 'render.py', os.path.join('bench', 'seed.py')):
+        with open(os.path.join(ROOT, path), 'rb') as source:
+            schema.update(source.read())
+    pristine = os.path.join(
+        args.data_dir, f"bench-u{args.users}-p{args.posts}-s{args.seed}-r{rounds}-{schema.hexdigest()[:8]}.db")
+    if not os.path.exists(pristine):
+        partial = pristine + '.partial'
+        if os.path.exists(partial):
+            os.remove(partial)
+        print(f"Seeding {pristine} ...", file=sys.stderr)
+        subprocess.run(
+            [sys.executable, os.path.join(ROOT, 'bench', 'seed.py'), '--db', partial,
+             '--users', str(args.users), '--posts', str(args.posts), '--seed', str(args.seed)],
+            cwd=ROOT, env=dict(os.environ, APP_ENV=args.config), check=True, stdout=sys.stderr,
+        )
+        # Fold the write-ahead log back in so the file can be copied on its own
+        subprocess.run([sys.executable, '-c', (
+            "import sqlite3, sys; c = sqlite3.connect(sys.argv[1]); "
+            "c.execute('PRAGMA wal_checkpoint(TRUNCATE)'); c.execute('PRAGMA journal_mode=DELETE'); c.close()"
+        ), partial], check=True)
+        os.rename(partial, pristine)
+
+    working = os.path.join(workdir, 'bench.db')
+    shutil.copyfile(pristine, working)
+    import sqlite3
+    connection = sqlite3.connect(working)
+    min_id, max_id = connection.execute('SELECT min(id), max(id) FROM post').fetchone()
+    connection.close()
+    return working, {'users': args.users, 'posts': args.posts, 'min_post_id': min_id, 'max_post_id': max_id}
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def run_client_mode(args, database, dataset):
+    os.environ['DATABASE_URL'] = f"sqlite:///{database}"
+    sys.path.insert(0, ROOT)
+    from app import create_app
+    app = create_app(args.config)
+    results = {}
+    for name in args.scenarios:
+        requests = args.login_requests if name == 'login' else args.requests
+        print(f"[client] {name}: {requests} requests", file=sys.stderr)
+        results[name] = run_scenario(
+            name, lambda: TestClient(app), dataset, requests, args.concurrency, args.warmup, args.seed, [os.getpid()])
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024  # KiB on Linux
+    return {'scenarios': results, 'peak_rss_mb': round(peak, 1)}
+
+
+def run_server_mode(args, database, dataset):
+    port = free_port()
+    env = dict(os.environ, DATABASE_URL=f"sqlite:///{database}", APP_ENV=args.config)
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'serve', '--bind', f"127.0.0.1:{port}",
+         '--workers', str(args.workers), '--threads', str(args.threads)],
+        cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        deadline = time.monotonic() + 60
+        while True:
+            try:
+                if HTTPClient('127.0.0.1', port).request('GET', '/healthz')[0] == 200:
+                    break
+            except OSError:
+                pass
+            if server.poll() is not None or time.monotonic() > deadline:
+                raise RuntimeError('Server failed to start')
+            time.sleep(0.2)
+
+        results = {}
+        for name in args.scenarios:
+            requests = args.login_requests if name == 'login' else args.requests
+            print(f"[server] {name}: {requests} requests", file=sys.stderr)
+            result = run_scenario(
+                name, lambda: HTTPClient('127.0.0.1', port), dataset, requests, args.server_concurrency,
+                args.warmup, args.seed, [server.pid])
+            if args.workers > 1:
+                result['queries_per_request'] = None
+            results[name] = result
+        peak = max((result['peak_rss_mb'] or 0) for result in results.values()) if results else None
+        return {'scenarios': results, 'peak_rss_mb': peak}
+    finally:
+        server.terminate()
+        try:
+            server.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            server.kill()
+
+
+def git_revision():
+    try:
+        revision = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=ROOT, capture_output=True, text=True, check=True)
+        dirty = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=ROOT,
+                               capture_output=True, text=True, check=True)
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return revision.stdout.strip()[:12] + ('-dirty' if dirty.stdout.strip() else '')
+
+
+def print_results(report):
+    header = f"{'mode':<7} {'scenario':<16} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'req/s':>8} {'q/req':>6} {'rss MB':>7} {'errors':>6}"
+    print(header)
+    for mode in ('client', 'server'):
+        for name, result in report.get(mode, {}).get('scenarios', {}).items():
+            queries = '-' if result['queries_per_request'] is None else result['queries_per_request']
+            print(f"{mode:<7} {name:<16} {result['p50_ms']:>9} {result['p95_ms']:>9} {result['p99_ms']:>9} "
+                  f"{result['req_per_s']:>8} {queries:>6} {result['peak_rss_mb'] or '-':>7} {result['errors']:>6}")
+
+
+# Print old -> new for each metric and return the list of regressions beyond max_regression percent
+def compare(baseline, report, max_regression):
+    regressions = []
+    print(f"\nCompared with {baseline['meta'].get('revision')} ({baseline['meta'].get('created')}):")
+    for mode in ('client', 'server'):
+        for name, result in report.get(mode, {}).get('scenarios', {}).items():
+            old = baseline.get(mode, {}).get('scenarios', {}).get(name)
+            if not old:
+                continue
+            cells = []
+            for key, higher_is_worse in (('p50_ms', True), ('p95_ms', True), ('p99_ms', True),
+                                         ('req_per_s', False), ('queries_per_request', True)):
+                if old.get(key) is None or result.get(key) is None:
+                    continue
+                change = (result[key] - old[key]) / old[key] * 100 if old[key] else 0.0
+                cells.append(f"{key} {old[key]} -> {result[key]} ({change:+.1f}%)")
+                worse = change if higher_is_worse else -change
+                if key == 'queries_per_request' and result[key] > old[key]:
+                    regressions.append(f"{mode}/{name} {key}")
+                elif key in ('p95_ms', 'req_per_s') and max_regression is not None and worse > max_regression:
+                    regressions.append(f"{mode}/{name} {key} {change:+.1f}%")
+            print(f"  {mode}/{name}: " + ', '.join(cells))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=10000)
+    parser.add_argument('--posts', type=int, default=100000)
+    parser.add_argument('--seed', type=int, default=42, help='random seed for the data and the request mix')
+    parser.add_argument('--data-dir', default=os.path.join(tempfile.gettempdir(), 'blog-bench'),
+                        help='where seeded databases are kept between runs')
+    parser.add_argument('--mode', choices=('client', 'server', 'both'), default='both')
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS), help='comma-separated subset of ' + ', '.join(SCENARIOS))
+    parser.add_argument('--requests', type=int, default=500, help='timed requests per scenario')
+    parser.add_argument('--login-requests', type=int, default=50, help='timed requests for login, which runs bcrypt')
+    parser.add_argument('--warmup', type=int, default=20)
+    parser.add_argument('--concurrency', type=int, default=1, help='threads driving the test client')
+    parser.add_argument('--server-concurrency', type=int, default=8, help='concurrent HTTP connections')
+    parser.add_argument('--workers', type=int, default=2, help='gunicorn worker processes')
+    parser.add_argument('--threads', type=int, default=4, help='threads per gunicorn worker')
+    parser.add_argument('--config', default='production', help='app config name (APP_ENV)')
+    parser.add_argument('--page-cache', default='null', choices=('null', 'memory', 'sqlite'),
+                        help="page cache backend; 'null' measures the routes themselves rather than cache hits")
+    parser.add_argument('--output', help='write the results as JSON to this file')
+    parser.add_argument('--compare', metavar='BASELINE', help='JSON results of an earlier run to diff against')
+    parser.add_argument('--max-regression', type=float, metavar='PERCENT',
+                        help='with --compare, exit 1 if p95 or req/s worsens by more than this')
+    args = parser.parse_args()
+    args.scenarios = [name.strip() for name in args.scenarios.split(',') if name.strip()]
+    unknown = set(args.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+
+    os.environ['PAGE_CACHE_BACKEND'] = args.page_cache
+    # The login scenario would otherwise run into the login rate limit
+    os.environ['RATELIMIT_ENABLED'] = '0'
+    # Production serves /metrics only with a token unless told otherwise; the query counts come from it
+    os.environ.setdefault('METRICS_ENABLED', '1')
+    os.environ['APP_ENV'] = args.config
+    report = {'meta': {
+        'revision': git_revision(),
+        'created': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'python': sys.version.split()[0],
+        'cpus': os.cpu_count(),
+        'users': args.users, 'posts': args.posts, 'seed': args.seed,
+        'requests': args.requests, 'login_requests': args.login_requests,
+        'concurrency': args.concurrency, 'server_concurrency': args.server_concurrency,
+        'workers': args.workers, 'threads': args.threads,
+        'config': args.config, 'page_cache': args.page_cache,
+    }}
+
+    with tempfile.TemporaryDirectory(prefix='blog-bench-') as workdir:
+        if args.mode in ('server', 'both'):
+            database, dataset = prepare_database(args, workdir)
+            report['server'] = run_server_mode(args, database, dataset)
+        if args.mode in ('client', 'both'):
+            database, dataset = prepare_database(args, workdir)
+            report['client'] = run_client_mode(args, database, dataset)
+
+    print_results(report)
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(report, output, indent=2)
+            output.write('\n')
+        print(f"\nResults written to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            regressions = compare(json.load(baseline_file), report, args.max_regression)
+        if regressions:
+            print('\nRegressions: ' + '; '.join(regressions))
+            if args.max_regression is not None:
+                sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+# Concurrency check for the SQLite engine profile: several processes write posts while others read the feed,
+# all against one local SQLite file. Reports throughput and "database is locked" errors; exits non-zero on any error.
+#
+#   python bench/sqlite_concurrency.py --writers 4 --readers 4 --seconds 5
+#   python bench/sqlite_concurrency.py --profile plain     # compare against SQLAlchemy's defaults
+import argparse
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def worker(role, seconds, results):
+    sys.path.insert(0, ROOT)
+    from sqlalchemy.exc import OperationalError
+    from app import create_app
+    from extensions import db
+    from feed import get_feed_page
+    from model import Post, User
+
+    app = create_app()
+    done = errors = 0
+    deadline = time.monotonic() + seconds
+    with app.app_context():
+        user_id = db.session.query(User.id).first()[0]
+        while time.monotonic() < deadline:
+            try:
+                if role == 'writer':
+                    db.session.add(Post(title='Concurrency', content='x' * 500, user_id=user_id))
+                    db.session.commit()
+                else:
+                    get_feed_page(limit=20)
+                    db.session.rollback()
+                done += 1
+            except OperationalError as e:
+                db.session.rollback()
+                if 'locked' not in str(e) and 'busy' not in str(e):
+                    raise
+                errors += 1
+    results.put((role, done, errors))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--writers', type=int, default=4)
+    parser.add_argument('--readers', type=int, default=4)
+    parser.add_argument('--seconds', type=float, default=5)
+    parser.add_argument('--profile', choices=['tuned', 'plain'], default='tuned')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp()
+    os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(workdir, 'concurrency.db')}"
+    os.environ['DB_ENGINE_PROFILE'] = args.profile
+
+    sys.path.insert(0, ROOT)
+    from app import create_app
+    from extensions import db
+    from model import User
+    app = create_app()
+    with app.app_context():
+        db.create_all()
+        if not User.query.first():
+            db.session.add(User(username='bench', email='bench@example.com', password='x'))
+            db.session.commit()
+        db.engine.dispose()
+
+    results = multiprocessing.Queue()
+    roles = ['writer'] * args.writers + ['reader'] * args.readers
+    processes = [multiprocessing.Process(target=worker, args=(role, args.seconds, results)) for role in roles]
+    for process in processes:
+        process.start()
+    totals = {'writer': [0, 0], 'reader': [0, 0]}
+    for _ in processes:
+        role, done, errors = results.get()
+        totals[role][0] += done
+        totals[role][1] += errors
+    for process in processes:
+        process.join()
+    shutil.rmtree(workdir, ignore_errors=True)
+
+    for role, (done, errors) in totals.items():
+        print(f"{role}s: {done / args.seconds:.0f} ops/sec, {errors} locked errors")
+    sys.exit(1 if totals['writer'][1] or totals['reader'][1] else 0)
+
+
+if __name__ == '__main__':
+    main()
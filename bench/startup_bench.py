@@ -0,0 +1,82 @@
+# Startup benchmark: time to import the app module, build the app and serve the first request, each measured
+# in a fresh interpreter. Pass --compare REF to run the same measurement on another git revision
+# (checked out into a temporary worktree) and print both side by side, e.g. before/after a change:
+#
+#   python bench/startup_bench.py --runs 5 --compare HEAD~1
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Runs inside the child interpreter, from the tree being measured. Older trees build the app at import
+# time and expose it as `app.app`; newer ones expose create_app().
+PROBE = r'''
+import json, sys, time
+sys.path.insert(0, '.')
+started = time.perf_counter()
+import app as module
+imported = time.perf_counter()
+application = module.create_app() if hasattr(module, 'create_app') else module.app
+created = time.perf_counter()
+response = application.test_client().get('/')
+served = time.perf_counter()
+print(json.dumps({
+    'import_ms': (imported - started) * 1000,
+    'create_ms': (created - imported) * 1000,
+    'first_request_ms': (served - created) * 1000,
+    'total_ms': (served - started) * 1000,
+    'status': response.status_code,
+}))
+'''
+
+
+# Create a database with the current tree's schema so every revision starts from the same state
+def prepare_database(path):
+    env = dict(os.environ, DATABASE_URL=f"sqlite:///{path}", FLASK_APP='app')
+    subprocess.run([sys.executable, '-m', 'flask', 'init-db'], cwd=ROOT, env=env, check=True, capture_output=True)
+
+
+def measure(tree, database, runs):
+    env = dict(os.environ, DATABASE_URL=f"sqlite:///{database}", PYTHONDONTWRITEBYTECODE='1')
+    samples = []
+    for _ in range(runs):
+        result = subprocess.run([sys.executable, '-c', PROBE], cwd=tree, env=env, check=True, capture_output=True, text=True)
+        samples.append(json.loads(result.stdout.strip().splitlines()[-1]))
+    return {key: statistics.median(sample[key] for sample in samples) for key in samples[0] if key != 'status'}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--compare', metavar='REF', help='git revision to measure alongside the working tree')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp()
+    try:
+        database = os.path.join(workdir, 'startup.db')
+        prepare_database(database)
+        columns = {'working tree': measure(ROOT, database, args.runs)}
+        if args.compare:
+            worktree = os.path.join(workdir, 'compare')
+            subprocess.run(['git', 'worktree', 'add', '--detach', worktree, args.compare], cwd=ROOT, check=True, capture_output=True)
+            try:
+                columns[args.compare] = measure(worktree, database, args.runs)
+            finally:
+                subprocess.run(['git', 'worktree', 'remove', '--force', worktree], cwd=ROOT, check=True, capture_output=True)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    names = list(columns)
+    print(f"{'median of ' + str(args.runs):<18}" + ''.join(f"{name:>16}" for name in names))
+    for key in ('import_ms', 'create_ms', 'first_request_ms', 'total_ms'):
+        print(f"{key:<18}" + ''.join(f"{columns[name][key]:>16.1f}" for name in names))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,348 @@
+import hashlib  # Used to build ETags from rendered bodies
+import os  # Used to resolve the on-disk cache location
+import secrets  # Random change-marker tokens
+import sqlite3  # Local key-value store shared by all workers on a host
+import threading  # Locks and per-thread connections
+import time  # Timestamps for Last-Modified, TTLs and LRU ordering
+from collections import OrderedDict, namedtuple  # LRU ordering for the in-process backend
+from functools import wraps
+from flask import make_response, request, session
+from flask_login import current_user
+
+# A cached response: the rendered body plus what is needed to rebuild and revalidate it
+CacheEntry = namedtuple('CacheEntry', ['body', 'mimetype', 'etag', 'last_modified', 'expires'])
+
+
+# Backend that never stores anything, used when caching is disabled
+class NullBackend:
+    def get(self, key):
+        return None
+
+    def set(self, key, entry):
+        pass
+
+    def delete_prefix(self, prefix):
+        pass
+
+    def clear(self):
+        pass
+
+
+# In-process LRU backend bounded by entry count and total body size.
+# Each worker process has its own copy, so invalidations only reach the worker that made them;
+# the TTL bounds how stale other workers can be.
+class MemoryBackend:
+    def __init__(self, max_entries=512, max_bytes=32 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)  # Mark as most recently used
+            return entry
+
+    def set(self, key, entry):
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._size -= len(old.body)
+            self._entries[key] = entry
+            self._size += len(entry.body)
+            # Evict least recently used entries until both bounds hold again
+            while self._entries and (len(self._entries) > self.max_entries or self._size > self.max_bytes):
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= len(evicted.body)
+
+    def delete_prefix(self, prefix):
+        with self._lock:
+            for key in [key for key in self._entries if key.startswith(prefix)]:
+                self._size -= len(self._entries.pop(key).body)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+
+# Per-thread connection to a local SQLite file shared by the workers on a host, kept on `local` (a threading.local)
+# and reopened should the path change. WAL lets readers in other workers proceed during writes.
+def sqlite_connection(local, path):
+    conn = getattr(local, 'conn', None)
+    if conn is None or local.path != path:
+        conn = sqlite3.connect(path, timeout=5, isolation_level=None, check_same_thread=False)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        local.conn, local.path = conn, path
+    return conn
+
+
+# SQLite-file backend so that every worker on a host shares one cache and sees every invalidation.
+# LRU order is approximate: a hit only refreshes the row's access time once it is ACCESS_RESOLUTION seconds old,
+# so most reads stay reads instead of write transactions every worker has to queue behind.
+class SQLiteBackend:
+    ACCESS_RESOLUTION = 60
+
+    def __init__(self, path, max_entries=512, max_bytes=32 * 1024 * 1024):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS page_cache ('
+                'key TEXT PRIMARY KEY, body BLOB NOT NULL, mimetype TEXT NOT NULL, etag TEXT NOT NULL, '
+                'last_modified REAL NOT NULL, expires REAL, size INTEGER NOT NULL, accessed REAL NOT NULL)'
+            )
+            conn.execute('CREATE INDEX IF NOT EXISTS ix_page_cache_accessed ON page_cache (accessed)')
+
+    def _connect(self):
+        return sqlite_connection(self._local, self.path)
+
+    def get(self, key):
+        conn = self._connect()
+        row = conn.execute(
+            'SELECT body, mimetype, etag, last_modified, expires, accessed FROM page_cache WHERE key = ?', (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        now = time.time()
+        if now - row[5] >= self.ACCESS_RESOLUTION:
+            conn.execute('UPDATE page_cache SET accessed = ? WHERE key = ?', (now, key))
+        return CacheEntry(*row[:5])
+
+    def set(self, key, entry):
+        conn = self._connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.execute(
+                'INSERT OR REPLACE INTO page_cache VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                (key, entry.body, entry.mimetype, entry.etag, entry.last_modified, entry.expires,
+                 len(entry.body), time.time()),
+            )
+            count, size = conn.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM page_cache').fetchone()
+            # Evict least recently used rows until both bounds hold again
+            while count > self.max_entries or size > self.max_bytes:
+                row = conn.execute('SELECT key, size FROM page_cache ORDER BY accessed LIMIT 1').fetchone()
+                if row is None:
+                    break
+                conn.execute('DELETE FROM page_cache WHERE key = ?', (row[0],))
+                count, size = count - 1, size - row[1]
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+    def delete_prefix(self, prefix):
+        # A range scan on the primary key rather than LIKE, so special characters in keys don't matter
+        self._connect().execute(
+            'DELETE FROM page_cache WHERE key >= ? AND key < ?', (prefix, prefix + '\uffff')
+        )
+
+    def clear(self):
+        self._connect().execute('DELETE FROM page_cache')
+
+
+# Change markers shared by every worker process on a host: a random token per name, replaced whenever the data
+# behind that name changes. Caches fold the tokens of what they depend on into their keys, so a write made in any
+# process (a web worker or `flask worker`) retires the entries built before it everywhere. Reading them is one
+# lookup in a small local SQLite file, not a query on the application database.
+class ChangeMarkers:
+    def __init__(self, app=None):
+        self.path = None
+        self._local = threading.local()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.path = app.config.get('CHANGE_MARKERS_PATH') or os.path.join(app.instance_path, 'change_markers.db')
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._connect().execute(
+            'CREATE TABLE IF NOT EXISTS change_marker (name TEXT PRIMARY KEY, token TEXT NOT NULL)'
+        )
+        app.extensions['change_markers'] = self
+
+    def _connect(self):
+        return sqlite_connection(self._local, self.path)
+
+    # The current token of each name, None for names that have never changed
+    def get(self, *names):
+        if self.path is None:
+            return (None,) * len(names)
+        rows = dict(self._connect().execute(
+            f"SELECT name, token FROM change_marker WHERE name IN ({', '.join('?' * len(names))})", names
+        ))
+        return tuple(rows.get(name) for name in names)
+
+    def bump(self, *names):
+        if self.path is None:
+            return
+        self._connect().executemany(
+            'INSERT OR REPLACE INTO change_marker VALUES (?, ?)', [(name, secrets.token_hex(8)) for name in names]
+        )
+
+
+# Small thread-safe LRU mapping whose entries expire after a TTL, with hit/miss counters
+class TTLCache:
+    def __init__(self, max_entries=1024, ttl=60):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._entries.get(key)
+            if item is not None and item[1] > time.monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return item[0]
+            if item is not None:
+                del self._entries[key]  # Expired
+            self.misses += 1
+            return None
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'size': len(self._entries)}
+
+
+# Rendered-page cache for anonymous GET traffic, keyed by endpoint, path and query string.
+# Views opt in with @page_cache.cached(); write routes call invalidate() with the endpoint
+# (and optionally the view arguments) whose pages they changed.
+# invalidate() and clear() also bump the matching change markers, whose tokens are part of every key, so the
+# invalidation reaches the in-process caches of the other workers too.
+class PageCache:
+    def __init__(self, app=None):
+        self.backend = NullBackend()
+        self.markers = None
+        self.ttl = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        name = app.config.get('PAGE_CACHE_BACKEND', 'memory')
+        max_entries = app.config.get('PAGE_CACHE_MAX_ENTRIES', 512)
+        max_bytes = app.config.get('PAGE_CACHE_MAX_BYTES', 32 * 1024 * 1024)
+        self.ttl = app.config.get('PAGE_CACHE_TTL')
+        if name == 'memory':
+            self.backend = MemoryBackend(max_entries, max_bytes)
+        elif name == 'sqlite':
+            path = app.config.get('PAGE_CACHE_PATH') or os.path.join(app.instance_path, 'page_cache.db')
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            self.backend = SQLiteBackend(path, max_entries, max_bytes)
+        elif name in (None, 'null', 'none'):
+            self.backend = NullBackend()
+        else:
+            raise ValueError(f"Unknown PAGE_CACHE_BACKEND: {name!r}")
+        self.markers = app.extensions.get('change_markers')
+        app.extensions['page_cache'] = self
+
+    # Cache key prefix for an endpoint, or for a single page of it when view arguments are given
+    @staticmethod
+    def key_prefix(endpoint, **view_args):
+        if view_args:
+            args = ','.join(f"{name}={view_args[name]}" for name in sorted(view_args))
+            return f"{endpoint}:{args}?"
+        return f"{endpoint}:"
+
+    # Change-marker tokens the current page depends on: everything, its endpoint, and the page itself
+    def request_markers(self):
+        names = ['*', self.key_prefix(request.endpoint)]
+        if request.view_args:
+            names.append(self.key_prefix(request.endpoint, **request.view_args))
+        if self.markers is None:
+            return (None,) * len(names)
+        return self.markers.get(*names)
+
+    def _request_key(self):
+        key = self.key_prefix(request.endpoint, **(request.view_args or {})) + request.query_string.decode('latin-1')
+        return f"{key}#{','.join(token or '-' for token in self.request_markers())}"
+
+    # Only anonymous GET/HEAD requests without pending flash messages see the shared page
+    @staticmethod
+    def _cacheable_request():
+        return (
+            request.method in ('GET', 'HEAD')
+            and not current_user.is_authenticated
+            and '_flashes' not in session
+        )
+
+    @staticmethod
+    def _build_response(entry):
+        response = make_response(entry.body)
+        response.mimetype = entry.mimetype
+        response.set_etag(entry.etag)
+        response.last_modified = entry.last_modified
+        # Shared caches must not hand an anonymous page to a logged-in visitor
+        response.vary.add('Cookie')
+        response.cache_control.no_cache = True
+        return response
+
+    # Decorator serving a view from the cache for anonymous visitors, with ETag/Last-Modified revalidation
+    def cached(self):
+        def decorator(view):
+            @wraps(view)
+            def wrapper(*args, **kwargs):
+                if isinstance(self.backend, NullBackend) or not self._cacheable_request():
+                    return view(*args, **kwargs)
+                key = self._request_key()
+                entry = self.backend.get(key)
+                if entry is not None and entry.expires is not None and entry.expires < time.time():
+                    entry = None
+                if entry is None:
+                    response = make_response(view(*args, **kwargs))
+                    if response.status_code != 200 or response.direct_passthrough:
+                        return response
+                    body = response.get_data()
+                    now = time.time()
+                    entry = CacheEntry(
+                        body,
+                        response.mimetype,
+                        hashlib.sha1(body).hexdigest(),
+                        int(now),
+                        now + self.ttl if self.ttl else None,
+                    )
+                    self.backend.set(key, entry)
+                    response = self._build_response(entry)
+                    response.headers['X-Cache'] = 'MISS'
+                else:
+                    response = self._build_response(entry)
+                    response.headers['X-Cache'] = 'HIT'
+                # Answers If-None-Match / If-Modified-Since with a bodiless 304 when they match
+                return response.make_conditional(request)
+            return wrapper
+        return decorator
+
+    # Drop every cached page of an endpoint, or only the page(s) for the given view arguments
+    def invalidate(self, endpoint, **view_args):
+        prefix = self.key_prefix(endpoint, **view_args)
+        self.backend.delete_prefix(prefix)
+        if self.markers is not None:
+            self.markers.bump(prefix)
+
+    def clear(self):
+        self.backend.clear()
+        if self.markers is not None:
+            self.markers.bump('*')
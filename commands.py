@@ -0,0 +1,34 @@
+import os
+import click
+from flask.cli import with_appcontext
+from extensions import db, password_hasher
+from model import User
+from search import ensure_search_index
+
+
+# `flask init-db`: create any missing tables and the full-text search index
+@click.command('init-db')
+@with_appcontext
+def init_db_command():
+    db.create_all()
+    with db.engine.begin() as connection:
+        ensure_search_index(connection)
+    click.echo('Database tables created.')
+
+
+# `flask seed-admin`: create the admin user if one doesn't already exist
+@click.command('seed-admin')
+@click.option('--username', default=lambda: os.environ.get('ADMIN_USERNAME', 'admin'), show_default='admin')
+@click.option('--email', default=lambda: os.environ.get('ADMIN_EMAIL', 'admin@example.com'), show_default='admin@example.com')
+@click.option('--password', default=lambda: os.environ.get('ADMIN_PASSWORD', 'adminpassword'), show_default='adminpassword')
+@with_appcontext
+def seed_admin_command(username, email, password):
+    existing_admin = User.query.filter_by(email=email).first()
+    if existing_admin:
+        click.echo(f"Admin user {existing_admin.username} already exists.")
+        return
+    admin_user = User(username=username, email=email, password=password_hasher.hash(password))
+    admin_user.is_admin = True
+    db.session.add(admin_user)
+    db.session.commit()
+    click.echo(f"Admin user {admin_user.username} created.")
@@ -0,0 +1,170 @@
+import zlib
+from werkzeug.datastructures import Headers
+from werkzeug.http import parse_accept_header, parse_set_header
+
+try:
+    import brotli  # Optional: enables 'br'
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard  # Optional: enables 'zstd'
+except ImportError:
+    zstandard = None
+
+# Media types worth compressing besides text/* and the +xml / +json families
+COMPRESSIBLE_TYPES = {
+    'application/javascript', 'application/json', 'application/xml', 'application/rss+xml',
+    'application/atom+xml', 'image/svg+xml',
+}
+
+
+# Incremental compressor with the same three operations for every encoding:
+# compress() buffers as it likes, flush() emits everything so far (for streamed pages), finish() ends the stream
+class _Compressor:
+    def __init__(self, encoding, level, brotli_quality):
+        self.encoding = encoding
+        if encoding == 'gzip':
+            self._compressor = zlib.compressobj(level, zlib.DEFLATED, 31)  # wbits 31: gzip container
+        elif encoding == 'br':
+            self._compressor = brotli.Compressor(quality=brotli_quality)
+        elif encoding == 'zstd':
+            self._compressor = zstandard.ZstdCompressor(level=level).compressobj()
+
+    def compress(self, data):
+        if self.encoding == 'br':
+            return self._compressor.process(data)
+        return self._compressor.compress(data)
+
+    def flush(self):
+        if self.encoding == 'gzip':
+            return self._compressor.flush(zlib.Z_SYNC_FLUSH)
+        if self.encoding == 'br':
+            return self._compressor.flush()
+        return self._compressor.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+
+    def finish(self):
+        if self.encoding == 'br':
+            return self._compressor.finish()
+        return self._compressor.flush()
+
+
+def available_encodings():
+    encodings = ['gzip']
+    if brotli is not None:
+        encodings.append('br')
+    if zstandard is not None:
+        encodings.append('zstd')
+    return encodings
+
+
+# WSGI middleware compressing responses on the fly with the best encoding the client accepts, in the server's
+# order of preference (`encodings`, limited to what is installed).
+# Responses are left alone when they are smaller than min_size, already encoded (e.g. the precompressed asset
+# bundles), not a text-like type, marked no-transform, 206/304 or answers to HEAD. Streamed responses without a
+# Content-Length are buffered only until min_size bytes have arrived, then compressed chunk by chunk with a flush
+# after every min_size bytes, so the browser can start rendering before the page is complete.
+# Compressed responses get `Vary: Accept-Encoding` and any strong ETag is made weak, since the bytes differ from
+# the uncompressed representation.
+class CompressionMiddleware:
+    def __init__(self, app, min_size=500, level=6, brotli_quality=4, encodings=('br', 'gzip')):
+        self.app = app
+        self.min_size = min_size
+        self.level = level
+        self.brotli_quality = brotli_quality
+        self.encodings = [encoding for encoding in encodings if encoding in available_encodings()]
+
+    def _negotiate(self, environ):
+        if environ.get('REQUEST_METHOD') == 'HEAD':
+            return None
+        accepted = parse_accept_header(environ.get('HTTP_ACCEPT_ENCODING'))
+        for encoding in self.encodings:
+            if accepted[encoding]:
+                return encoding
+        return None
+
+    @staticmethod
+    def _compressible(status, headers):
+        if status[:3] in ('204', '206', '304') or 'Content-Encoding' in headers:
+            return False
+        if 'no-transform' in headers.get('Cache-Control', ''):
+            return False
+        mimetype = headers.get('Content-Type', '').split(';')[0].strip().lower()
+        return (
+            mimetype.startswith('text/') or mimetype in COMPRESSIBLE_TYPES
+            or mimetype.endswith(('+xml', '+json'))
+        )
+
+    def __call__(self, environ, start_response):
+        captured = []
+
+        def capture(status, headers, exc_info=None):
+            captured[:] = [status, headers, exc_info]
+            return self._write_unsupported
+
+        app_iter = self.app(environ, capture)
+        return self._respond(app_iter, captured, self._negotiate(environ), start_response)
+
+    @staticmethod
+    def _write_unsupported(data):
+        raise RuntimeError('CompressionMiddleware does not support the WSGI write() callable')
+
+    def _respond(self, app_iter, captured, encoding, start_response):
+        try:
+            chunks = iter(app_iter)
+            pending = []
+            # An app may call start_response only once it produces its first chunk
+            while not captured:
+                pending.append(next(chunks))
+            status, header_list, exc_info = captured
+            headers = Headers(header_list)
+
+            compressible = self._compressible(status, headers)
+            if compressible:
+                vary = parse_set_header(headers.get('Vary'))
+                vary.add('Accept-Encoding')
+                headers['Vary'] = vary.to_header()
+            length = headers.get('Content-Length', type=int)
+            streamed = length is None
+            if compressible and encoding and streamed:
+                # Buffer the start of a streamed body to see whether it is big enough to bother
+                size = sum(len(chunk) for chunk in pending)
+                for chunk in chunks:
+                    pending.append(chunk)
+                    size += len(chunk)
+                    if size >= self.min_size:
+                        break
+                else:
+                    length = size
+            if not (compressible and encoding) or (length is not None and length < self.min_size):
+                start_response(status, headers.to_wsgi_list(), exc_info)
+                yield from pending
+                yield from chunks
+                return
+
+            compressor = _Compressor(encoding, self.level, self.brotli_quality)
+            headers['Content-Encoding'] = encoding
+            headers.remove('Content-Length')
+            etag = headers.get('ETag')
+            if etag and not etag.startswith('W/'):
+                headers['ETag'] = 'W/' + etag
+            start_response(status, headers.to_wsgi_list(), exc_info)
+
+            for chunk in pending:
+                data = compressor.compress(chunk)
+                if data:
+                    yield data
+            unflushed = 0
+            for chunk in chunks:
+                data = compressor.compress(chunk)
+                unflushed += len(chunk)
+                # Flushing every tiny template chunk would ruin the ratio, so wait for min_size bytes
+                if streamed and unflushed >= self.min_size:
+                    data += compressor.flush()
+                    unflushed = 0
+                if data:
+                    yield data
+            yield compressor.finish()
+        finally:
+            if hasattr(app_iter, 'close'):
+                app_iter.close()
@@ -0,0 +1,70 @@
+import hashlib  # Used to build ETags from change markers
+import os
+from functools import wraps
+from flask import current_app, make_response, request, session
+from flask_login import current_user
+from extensions import page_cache
+from render import RENDERER_VERSION
+
+
+# Token covering what a page looks like apart from the data: templates, the asset bundles and the Markdown renderer.
+# Computed once per process, or on every request in debug mode where templates change under the running app.
+def release_token(app):
+    token = app.extensions.get('conditional_release')
+    if token is None or app.debug:
+        digest = hashlib.sha1(str(RENDERER_VERSION).encode('utf-8'))
+        folder = os.path.join(app.root_path, app.template_folder)
+        for root, dirs, files in os.walk(folder):
+            dirs.sort()
+            for name in sorted(files):
+                path = os.path.join(root, name)
+                digest.update(os.path.relpath(path, folder).encode('utf-8'))
+                with open(path, 'rb') as template:
+                    digest.update(template.read())
+        assets = app.extensions.get('assets')
+        if assets is not None:
+            digest.update(repr(sorted(assets.manifest(app).items())).encode('utf-8'))
+        token = app.extensions['conditional_release'] = digest.hexdigest()[:16]
+    return token
+
+
+# Decorator answering If-None-Match from the page's change markers (see PageCache.request_markers) before the
+# view runs. Every write that changes a page already invalidates it in the page cache, which bumps those markers,
+# so they make a cheap version stamp that needs no query on the application database.
+# The weak ETag covers the endpoint, view arguments and query string, the markers, the release token and who is
+# asking (anonymous, or the user's id and version, since the navbar and edit buttons depend on them), so a
+# matching request gets a 304 without rendering a template. Otherwise the view runs and its response carries
+# the same ETag. Requests with pending flash messages always get the full page.
+# Put it inside @page_cache.cached(), which answers anonymous visitors from the cache first.
+def conditional():
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if request.method not in ('GET', 'HEAD') or '_flashes' in session:
+                return view(*args, **kwargs)
+            state = page_cache.request_markers()
+            authenticated = current_user.is_authenticated
+            who = f"{current_user.id}:{current_user.version}" if authenticated else 'anon'
+            view_args = ','.join(f"{name}={kwargs[name]}" for name in sorted(kwargs))
+            etag = hashlib.sha1(
+                '|'.join((
+                    release_token(current_app), request.endpoint, view_args,
+                    request.query_string.decode('latin-1'), repr(state), who,
+                )).encode('utf-8')
+            ).hexdigest()[:20]
+
+            if request.if_none_match.contains_weak(etag):
+                response = current_app.response_class(status=304)
+            else:
+                response = make_response(view(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+            response.set_etag(etag, weak=True)
+            # The page differs per visitor: shared caches must key on the session cookie and always revalidate
+            response.vary.add('Cookie')
+            response.cache_control.no_cache = True
+            if authenticated:
+                response.cache_control.private = True
+            return response
+        return wrapper
+    return decorator
@@ -1,5 +1,13 @@
 import os  # Import the os module to interact with the operating system
 
+
+# Some hosts hand out 'postgres://' URLs, which SQLAlchemy no longer accepts as a dialect name
+def normalize_database_url(url):
+    if url and url.startswith('postgres://'):
+        return 'postgresql://' + url[len('postgres://'):]
+    return url
+
+
 class Config:
     # SECRET_KEY is used for securely signing the session cookie and can be used for other security-related needs.
     # It retrieves the value from the environment variable 'SECRET_KEY' if it exists, otherwise it defaults to 'a_hard_to_guess_string'.
@@ -7,8 +15,177 @@ class Config:
 
     # SQLALCHEMY_DATABASE_URI sets the database URI that should be used for the connection.
     # It retrieves the value from the environment variable 'DATABASE_URL' if it exists, otherwise it defaults to using a SQLite database file named 'site.db'.
-    SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL') or 'sqlite:///site.db'
+    SQLALCHEMY_DATABASE_URI = normalize_database_url(os.environ.get('DATABASE_URL')) or 'sqlite:///site.db'
 
     # SQLALCHEMY_TRACK_MODIFICATIONS is set to False to disable tracking modifications of objects and emitting signals.
     # This is for performance reasons as it adds significant overhead.
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+
+    # FEED_PAGE_SIZE is the number of posts shown per page of the home feed.
+    # FEED_MAX_PAGE_SIZE caps the ?limit= a client may ask for on the feed API.
+    FEED_PAGE_SIZE = int(os.environ.get('FEED_PAGE_SIZE', 20))
+    FEED_MAX_PAGE_SIZE = int(os.environ.get('FEED_MAX_PAGE_SIZE', 100))
+
+    # ADMIN_PAGE_SIZE is the number of users shown per page in each list on the admin dashboard.
+    ADMIN_PAGE_SIZE = int(os.environ.get('ADMIN_PAGE_SIZE', 50))
+    # BULK_CHUNK_SIZE is the number of users changed per statement and transaction by bulk admin actions.
+    BULK_CHUNK_SIZE = int(os.environ.get('BULK_CHUNK_SIZE', 500))
+
+    # PAGE_CACHE_BACKEND selects where rendered pages for anonymous visitors are cached:
+    # 'memory' (per process), 'sqlite' (a local file shared by all workers on the host) or 'null' (disabled).
+    PAGE_CACHE_BACKEND = os.environ.get('PAGE_CACHE_BACKEND', 'memory')
+    # PAGE_CACHE_PATH is the file used by the 'sqlite' backend; defaults to page_cache.db in the instance folder.
+    PAGE_CACHE_PATH = os.environ.get('PAGE_CACHE_PATH')
+    # PAGE_CACHE_MAX_ENTRIES and PAGE_CACHE_MAX_BYTES bound the cache; least recently used pages are evicted first.
+    PAGE_CACHE_MAX_ENTRIES = int(os.environ.get('PAGE_CACHE_MAX_ENTRIES', 512))
+    PAGE_CACHE_MAX_BYTES = int(os.environ.get('PAGE_CACHE_MAX_BYTES', 32 * 1024 * 1024))
+    # CHANGE_MARKERS_PATH is the local file through which workers on a host tell each other which cached pages and
+    # users have changed; defaults to change_markers.db in the instance folder.
+    CHANGE_MARKERS_PATH = os.environ.get('CHANGE_MARKERS_PATH')
+    # PAGE_CACHE_TTL (seconds) caps the age of a cached page, bounding staleness for writes that bypass invalidate().
+    PAGE_CACHE_TTL = int(os.environ.get('PAGE_CACHE_TTL', 300))
+
+    # EXPORT_DIR is where `flask export` writes the static copy of the public pages (default: instance/export),
+    # and EXPORT_BASE_URL the public site URL used for absolute links in the Atom feed and sitemaps.
+    # With EXPORT_ON_WRITE on, creating, editing or deleting posts re-exports the changed pages in the background.
+    EXPORT_DIR = os.environ.get('EXPORT_DIR')
+    EXPORT_BASE_URL = os.environ.get('EXPORT_BASE_URL')
+    EXPORT_ON_WRITE = os.environ.get('EXPORT_ON_WRITE') == '1'
+
+    # COMPRESSION_ENABLED compresses text responses of at least COMPRESSION_MIN_SIZE bytes on the fly, using the
+    # first of COMPRESSION_ENCODINGS (in order of preference) that the client accepts and that is installed:
+    # 'br' needs the brotli package and 'zstd' the zstandard package; 'gzip' is always available.
+    # COMPRESSION_LEVEL is the gzip/zstd level and COMPRESSION_BROTLI_QUALITY the brotli quality (0-11).
+    COMPRESSION_ENABLED = os.environ.get('COMPRESSION_ENABLED', '1') == '1'
+    COMPRESSION_MIN_SIZE = int(os.environ.get('COMPRESSION_MIN_SIZE', 500))
+    COMPRESSION_LEVEL = int(os.environ.get('COMPRESSION_LEVEL', 6))
+    COMPRESSION_BROTLI_QUALITY = int(os.environ.get('COMPRESSION_BROTLI_QUALITY', 4))
+    COMPRESSION_ENCODINGS = [
+        encoding.strip() for encoding in os.environ.get('COMPRESSION_ENCODINGS', 'br,gzip').split(',') if encoding.strip()
+    ]
+
+    # Background jobs (jobs.py) are stored in the database and run by `flask worker`, with JOBS_CONCURRENCY threads
+    # polling every JOBS_POLL_INTERVAL seconds when idle. A job still running after JOBS_LEASE_SECONDS is assumed
+    # lost and handed to another worker; failed jobs are retried after JOBS_BACKOFF_BASE * 2^(attempt - 1) seconds,
+    # capped at JOBS_BACKOFF_MAX. With JOBS_INLINE on, jobs run inside the request that queues them instead.
+    JOBS_INLINE = os.environ.get('JOBS_INLINE') == '1'
+    JOBS_CONCURRENCY = int(os.environ.get('JOBS_CONCURRENCY', 2))
+    JOBS_POLL_INTERVAL = float(os.environ.get('JOBS_POLL_INTERVAL', 1.0))
+    JOBS_LEASE_SECONDS = int(os.environ.get('JOBS_LEASE_SECONDS', 300))
+    JOBS_BACKOFF_BASE = float(os.environ.get('JOBS_BACKOFF_BASE', 5))
+    JOBS_BACKOFF_MAX = float(os.environ.get('JOBS_BACKOFF_MAX', 3600))
+
+    # Token-bucket rate limits checked before login, registration and /add_test_user do any bcrypt or database work.
+    # RATELIMITS gives each endpoint a rate per client IP and, for login, per account (the submitted email), as
+    # 'N/second|minute|hour|day' with N of at least 1; the bucket holds N tokens and refills at that rate.
+    # An empty rate disables a limit.
+    # RATELIMIT_BACKEND is 'sqlite' (a local file shared by all workers on the host, RATELIMIT_PATH, default
+    # rate_limit.db in the instance folder) or 'memory' (per process). Behind a reverse proxy, set
+    # RATELIMIT_PROXY_COUNT to the number of proxies so the client IP is read from X-Forwarded-For.
+    RATELIMIT_ENABLED = os.environ.get('RATELIMIT_ENABLED', '1') == '1'
+    RATELIMIT_BACKEND = os.environ.get('RATELIMIT_BACKEND', 'sqlite')
+    RATELIMIT_PATH = os.environ.get('RATELIMIT_PATH')
+    RATELIMIT_PROXY_COUNT = int(os.environ.get('RATELIMIT_PROXY_COUNT', 0))
+    RATELIMITS = {
+        'login': {
+            'ip': os.environ.get('RATELIMIT_LOGIN_IP', '30/minute'),
+            'account': os.environ.get('RATELIMIT_LOGIN_ACCOUNT', '10/minute'),
+        },
+        'register': {'ip': os.environ.get('RATELIMIT_REGISTER_IP', '10/hour')},
+        'add_test_user': {'ip': os.environ.get('RATELIMIT_ADD_TEST_USER_IP', '5/hour')},
+    }
+
+    # USER_CACHE_MAX_ENTRIES and USER_CACHE_TTL (seconds) bound the per-process cache of logged-in users
+    # consulted on every request; the TTL bounds staleness for changes made without user_cache.invalidate().
+    USER_CACHE_MAX_ENTRIES = int(os.environ.get('USER_CACHE_MAX_ENTRIES', 4096))
+    USER_CACHE_TTL = int(os.environ.get('USER_CACHE_TTL', 30))
+
+    # BCRYPT_LOG_ROUNDS is the bcrypt cost factor for new password hashes; hashes made at any other cost
+    # are upgraded the next time their owner logs in.
+    BCRYPT_LOG_ROUNDS = int(os.environ.get('BCRYPT_LOG_ROUNDS', 12))
+    # PASSWORD_HASH_EXECUTOR ('thread' or 'process') and PASSWORD_HASH_WORKERS size the pool that runs bcrypt.
+    # Defaults to one worker per CPU.
+    PASSWORD_HASH_EXECUTOR = os.environ.get('PASSWORD_HASH_EXECUTOR', 'thread')
+    PASSWORD_HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS', 0)) or None
+    # PASSWORD_HASH_MAX_PENDING caps queued plus running hashing jobs; further requests get a 503 straight away.
+    # PASSWORD_HASH_TIMEOUT (seconds) is how long a request waits for its job before giving up.
+    PASSWORD_HASH_MAX_PENDING = int(os.environ.get('PASSWORD_HASH_MAX_PENDING', 0)) or None
+    PASSWORD_HASH_TIMEOUT = float(os.environ.get('PASSWORD_HASH_TIMEOUT', 10))
+
+    # METRICS_ENABLED serves request timings, SQL counts, template and bcrypt times at /metrics (Prometheus text format).
+    # If METRICS_TOKEN is set, scrapers must send it as 'Authorization: Bearer <token>'. Production only serves it
+    # when METRICS_TOKEN is set, unless METRICS_ENABLED says otherwise.
+    METRICS_ENABLED = os.environ.get('METRICS_ENABLED', '1') == '1'
+    METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+    # PROFILING_ENABLED lets a request with the header 'X-Profile: 1' run under cProfile; stats go to PROFILE_DIR
+    # (default: instance/profiles) and the top functions are logged. Keep it off in production.
+    PROFILING_ENABLED = os.environ.get('PROFILING_ENABLED') == '1'
+    PROFILE_DIR = os.environ.get('PROFILE_DIR')
+    # Log a warning for any request issuing more than QUERY_COUNT_WARN_THRESHOLD SQL statements.
+    # Active in debug mode, or everywhere when QUERY_COUNT_WARNINGS is on.
+    QUERY_COUNT_WARN_THRESHOLD = int(os.environ.get('QUERY_COUNT_WARN_THRESHOLD', 20))
+    QUERY_COUNT_WARNINGS = os.environ.get('QUERY_COUNT_WARNINGS') == '1'
+
+    # DB_ENGINE_PROFILE selects how the database engine is tuned when the app starts:
+    # 'tuned' applies the SQLite pragmas or connection-pool settings below, 'plain' leaves SQLAlchemy's defaults.
+    DB_ENGINE_PROFILE = os.environ.get('DB_ENGINE_PROFILE', 'tuned')
+
+    # SQLite pragmas applied to every new connection. WAL lets readers run alongside a writer,
+    # synchronous=NORMAL is safe under WAL, and busy_timeout makes writers wait for the lock instead of failing
+    # with "database is locked". SQLITE_CACHE_SIZE is negative, meaning KiB rather than pages.
+    SQLITE_JOURNAL_MODE = os.environ.get('SQLITE_JOURNAL_MODE', 'WAL')
+    SQLITE_SYNCHRONOUS = os.environ.get('SQLITE_SYNCHRONOUS', 'NORMAL')
+    SQLITE_BUSY_TIMEOUT_MS = int(os.environ.get('SQLITE_BUSY_TIMEOUT_MS', 5000))
+    SQLITE_MMAP_SIZE = int(os.environ.get('SQLITE_MMAP_SIZE', 256 * 1024 * 1024))
+    SQLITE_CACHE_SIZE = int(os.environ.get('SQLITE_CACHE_SIZE', -64000))
+
+    # Connection-pool settings for server databases such as Postgres (DATABASE_URL).
+    # Pre-ping discards connections the server has dropped; recycle retires them before server-side timeouts.
+    DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 5))
+    DB_MAX_OVERFLOW = int(os.environ.get('DB_MAX_OVERFLOW', 10))
+    DB_POOL_TIMEOUT = int(os.environ.get('DB_POOL_TIMEOUT', 10))
+    DB_POOL_RECYCLE = int(os.environ.get('DB_POOL_RECYCLE', 1800))
+    DB_POOL_PRE_PING = True
+
+    # DATABASE_REPLICA_URL optionally points at a read replica; read-only views (home, post, admin dashboard)
+    # are then routed to it while every write still goes to the primary.
+    DATABASE_REPLICA_URL = normalize_database_url(os.environ.get('DATABASE_REPLICA_URL'))
+    SQLALCHEMY_BINDS = {'replica': DATABASE_REPLICA_URL} if DATABASE_REPLICA_URL else {}
+
+
+# Local development: the defaults above against the SQLite file, running background jobs inline
+# so that `python app.py` works without a separate worker
+class DevelopmentConfig(Config):
+    JOBS_INLINE = os.environ.get('JOBS_INLINE', '1') == '1'
+
+
+# Production: larger connection pools for multi-threaded workers, and /metrics only with a token
+class ProductionConfig(Config):
+    METRICS_ENABLED = os.environ.get('METRICS_ENABLED', '1' if os.environ.get('METRICS_TOKEN') else '0') == '1'
+    DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 10))
+    DB_MAX_OVERFLOW = int(os.environ.get('DB_MAX_OVERFLOW', 20))
+
+
+# Tests: an in-memory database, no page cache, cheap password hashes and inline background jobs
+class TestingConfig(Config):
+    TESTING = True
+    SQLALCHEMY_DATABASE_URI = normalize_database_url(os.environ.get('TEST_DATABASE_URL')) or 'sqlite://'
+    SQLALCHEMY_BINDS = {}
+    PAGE_CACHE_BACKEND = 'null'
+    BCRYPT_LOG_ROUNDS = 4
+    JOBS_INLINE = True
+    RATELIMIT_BACKEND = 'memory'
+
+
+# Configuration classes by environment name
+config_by_name = {
+    'development': DevelopmentConfig,
+    'production': ProductionConfig,
+    'testing': TestingConfig,
+}
+
+
+# Pick the configuration for the environment named by APP_ENV (or FLASK_ENV), defaulting to development
+def get_config(name=None):
+    name = name or os.environ.get('APP_ENV') or os.environ.get('FLASK_ENV') or 'development'
+    return config_by_name[name]
@@ -0,0 +1,87 @@
+from datetime import datetime, timedelta
+from sqlalchemy import and_, case, func, or_
+from extensions import db
+from model import Post, User
+
+
+# One page of users ordered by username, read lazily so a streamed template can start rendering first.
+# After iteration, next_cursor holds the username to continue after, or None on the last page.
+class UserPage:
+    def __init__(self, query, limit):
+        self.query = query
+        self.limit = limit
+        self.next_cursor = None
+
+    def __iter__(self):
+        count = 0
+        last = None
+        for user in self.query.limit(self.limit + 1):
+            if count == self.limit:
+                self.next_cursor = last.username
+                break
+            count += 1
+            last = user
+            yield user
+
+
+# Filter for users whose username or email starts with prefix.
+# Prefixes are matched as ranges rather than LIKE so the unique username and email indexes can be used.
+def user_prefix_filter(prefix):
+    upper = prefix + '\uffff'
+    return or_(
+        and_(User.username >= prefix, User.username < upper),
+        and_(User.email >= prefix, User.email < upper),
+    )
+
+
+# Filter for users with (True) or without (False) admin rights; users from before the is_admin column are non-admins
+def user_admin_filter(is_admin):
+    if is_admin:
+        return User.is_admin.is_(True)
+    return or_(User.is_admin.is_(False), User.is_admin.is_(None))
+
+
+# Users with or without admin rights whose username or email starts with prefix, after the given username
+def user_page(is_admin, prefix=None, after=None, limit=50):
+    query = db.session.query(User.id, User.username, User.email).filter(user_admin_filter(is_admin))
+    if prefix:
+        query = query.filter(user_prefix_filter(prefix))
+    if after:
+        query = query.filter(User.username > after)
+    return UserPage(query.order_by(User.username), limit)
+
+
+# Site totals computed in the database: users, admins and posts
+def dashboard_totals():
+    users, admins = db.session.query(
+        func.count(User.id),
+        func.coalesce(func.sum(case((User.is_admin.is_(True), 1), else_=0)), 0),
+    ).one()
+    posts = db.session.query(func.count(Post.id)).scalar()
+    return {'users': users, 'admins': admins, 'posts': posts}
+
+
+# The users with the most posts, as (username, post count) rows
+def top_posters(limit=10):
+    post_count = func.count(Post.id).label('post_count')
+    return (
+        db.session.query(User.username, post_count)
+        .join(Post, Post.user_id == User.id)
+        .group_by(User.id, User.username)
+        .order_by(post_count.desc())
+        .limit(limit)
+        .all()
+    )
+
+
+# Number of new users per day over the last `days` days, as (day, count) rows, most recent first
+def signups_per_day(days=30):
+    day = func.date(User.date_joined).label('day')
+    since = datetime.utcnow() - timedelta(days=days)
+    return (
+        db.session.query(day, func.count(User.id))
+        .filter(User.date_joined >= since)
+        .group_by(day)
+        .order_by(day.desc())
+        .all()
+    )
@@ -0,0 +1,306 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import time
+from datetime import datetime
+import click
+from flask import current_app, render_template
+from flask.cli import with_appcontext
+from markupsafe import escape
+from sqlalchemy import func
+from sqlalchemy.orm import joinedload
+from assets import assets
+from extensions import db
+from feed import card_query, feed_post
+from jobs import job_queue
+from model import Post
+from render import RENDERER_VERSION
+
+try:
+    import fcntl  # Serializes exports from several worker processes; not available on Windows
+except ImportError:
+    fcntl = None
+
+# Bump when the layout of the exported site changes, forcing the next export to rebuild everything
+EXPORT_FORMAT = 1
+
+MANIFEST_NAME = 'manifest.json'
+
+# Posts listed in each sitemap file (the protocol allows at most 50,000)
+SITEMAP_CHUNK_SIZE = 10000
+
+# Number of newest posts in the Atom feed
+ATOM_ENTRIES = 20
+
+# Posts loaded per query while writing post pages
+POST_BATCH_SIZE = 200
+
+
+# Timestamp in the RFC 3339 form Atom and sitemaps expect; stored times are naive UTC
+def rfc3339(value):
+    return value.replace(microsecond=0).isoformat() + 'Z'
+
+
+def _signature(*parts):
+    return hashlib.sha1('\n'.join(str(part) for part in parts).encode('utf-8')).hexdigest()
+
+
+# Write a file atomically, so a static server never sees it half written
+def _write(path, content):
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    handle, temporary = tempfile.mkstemp(dir=directory, prefix='.tmp-')
+    with os.fdopen(handle, 'w', encoding='utf-8') as output:
+        output.write(content)
+    os.chmod(temporary, 0o644)
+    os.replace(temporary, path)
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+# Everything besides the posts themselves that shapes the exported pages: when it changes, rebuild from scratch
+def _site_signature(app, base_url):
+    digest = hashlib.sha1(
+        f"{EXPORT_FORMAT}:{RENDERER_VERSION}:{app.config['FEED_PAGE_SIZE']}:{base_url}".encode('utf-8')
+    )
+    for folder in (os.path.join(app.root_path, app.template_folder), app.static_folder):
+        for root, dirs, files in os.walk(folder):
+            dirs.sort()
+            for name in sorted(files):
+                path = os.path.join(root, name)
+                digest.update(os.path.relpath(path, folder).encode('utf-8'))
+                with open(path, 'rb') as source:
+                    digest.update(hashlib.sha1(source.read()).digest())
+    return digest.hexdigest()
+
+
+# Split the posts (oldest first) into static feed pages, newest first within each page.
+# Archive pages are numbered from the oldest post, so they stay the same as new posts arrive and only the front
+# page (the newest one to two pages' worth of posts) changes. Returns (name, rows, older page url) tuples.
+def _feed_pages(rows, page_size):
+    full_pages = len(rows) // page_size
+    if full_pages <= 1:
+        return [('index', rows[::-1], None)]
+    pages = [('index', rows[(full_pages - 1) * page_size:][::-1], f"/page/{full_pages - 1}")]
+    for number in range(1, full_pages):
+        older = f"/page/{number - 1}" if number > 1 else None
+        pages.append((f"page/{number}", rows[(number - 1) * page_size:number * page_size][::-1], older))
+    return pages
+
+
+# Mirror the app's static folder into the export, copying only files that changed
+def _sync_static(source, target):
+    copied = 0
+    wanted = set()
+    for root, dirs, files in os.walk(source):
+        for name in files:
+            relative = os.path.relpath(os.path.join(root, name), source)
+            wanted.add(relative)
+            source_path = os.path.join(source, relative)
+            target_path = os.path.join(target, relative)
+            source_stat = os.stat(source_path)
+            try:
+                target_stat = os.stat(target_path)
+                if target_stat.st_size == source_stat.st_size and target_stat.st_mtime_ns == source_stat.st_mtime_ns:
+                    continue
+            except FileNotFoundError:
+                pass
+            os.makedirs(os.path.dirname(target_path), exist_ok=True)
+            shutil.copy2(source_path, target_path)
+            copied += 1
+    for root, dirs, files in os.walk(target):
+        for name in files:
+            path = os.path.join(root, name)
+            if os.path.relpath(path, target) not in wanted:
+                os.remove(path)
+    return copied
+
+
+# Exclusive lock on the export directory, held across processes while an export runs
+class _DirectoryLock:
+    def __init__(self, directory):
+        self.path = os.path.join(directory, '.lock')
+        self.handle = None
+
+    def __enter__(self):
+        self.handle = open(self.path, 'w')
+        if fcntl is not None:
+            fcntl.flock(self.handle, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc):
+        if fcntl is not None:
+            fcntl.flock(self.handle, fcntl.LOCK_UN)
+        self.handle.close()
+
+
+# Static export of the public, anonymous pages: the feed (index.html and archive pages under page/), a page per
+# post under post/, an Atom feed, sitemaps and a copy of the static folder. A plain static file server or CDN can
+# then answer anonymous reads, e.g. nginx with `try_files $uri $uri.html $uri/index.html @app`.
+#
+# Exports are incremental: manifest.json records the updated stamp of every exported post and a signature of
+# every other file, and only what differs is written again. Changing templates, static files, the renderer or
+# the page size rebuilds everything. With EXPORT_ON_WRITE, schedule() queues a re-export on the background job
+# queue after posts change; requests made while one is still waiting to start share that job.
+class StaticExporter:
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.extensions['static_export'] = self
+
+    def directory(self, app):
+        return app.config.get('EXPORT_DIR') or os.path.join(app.instance_path, 'export')
+
+    # Bring the export up to date with the database; full=True rewrites every file. Returns a summary.
+    def export(self, directory=None, full=False):
+        app = current_app._get_current_object()
+        directory = directory or self.directory(app)
+        os.makedirs(directory, exist_ok=True)
+        with _DirectoryLock(directory):
+            return self._export(app, directory, full)
+
+    def _export(self, app, directory, full):
+        started = time.perf_counter()
+        base_url = app.config.get('EXPORT_BASE_URL') or 'http://localhost:5500'
+        site_url = base_url.rstrip('/') + '/'
+        # The pages link to the asset bundles, so build them first if needed; they are part of the static folder
+        assets.manifest(app)
+        site_signature = _site_signature(app, base_url)
+        manifest_path = os.path.join(directory, MANIFEST_NAME)
+        previous = {}
+        if os.path.exists(manifest_path):
+            with open(manifest_path, encoding='utf-8') as manifest_file:
+                previous = json.load(manifest_file)
+        # The previous manifest still says which files to clean up, even when everything is being rewritten
+        rebuild = full or previous.get('signature') != site_signature
+        exported_posts = {} if rebuild else previous.get('posts', {})
+        exported_files = {} if rebuild else previous.get('files', {})
+        summary = {'posts_written': 0, 'posts_removed': 0, 'files_written': 0, 'files_removed': 0}
+
+        # One narrow scan gives every post's position in the feed and its updated stamp
+        rows = (
+            db.session.query(Post.id, Post.date_posted, func.coalesce(Post.date_updated, Post.date_posted).label('stamp'))
+            .order_by(Post.date_posted, Post.id)
+            .all()
+        )
+        stamps = {str(row.id): row.stamp.isoformat() for row in rows}
+        changed = [int(post_id) for post_id, stamp in stamps.items() if exported_posts.get(post_id) != stamp]
+        removed = [post_id for post_id in previous.get('posts', {}) if post_id not in stamps]
+
+        files = {}
+
+        def write_if_changed(name, signature, build):
+            files[name] = signature
+            if exported_files.get(name) != signature:
+                _write(os.path.join(directory, name), build())
+                summary['files_written'] += 1
+
+        with app.test_request_context('/', base_url=base_url):
+            for start in range(0, len(changed), POST_BATCH_SIZE):
+                batch = changed[start:start + POST_BATCH_SIZE]
+                for post in db.session.query(Post).options(joinedload(Post.author)).filter(Post.id.in_(batch)):
+                    _write(
+                        os.path.join(directory, 'post', f"{post.id}.html"),
+                        render_template('view_post.html', title=post.title, post=post),
+                    )
+                    summary['posts_written'] += 1
+                db.session.expunge_all()
+            for post_id in removed:
+                _remove(os.path.join(directory, 'post', f"{post_id}.html"))
+                summary['posts_removed'] += 1
+
+            for name, page_rows, older_url in _feed_pages(rows, app.config['FEED_PAGE_SIZE']):
+                signature = _signature(older_url, *(f"{row.id}:{stamps[str(row.id)]}" for row in page_rows))
+
+                def build_page(page_rows=page_rows, older_url=older_url):
+                    ids = [row.id for row in page_rows]
+                    cards = card_query().filter(Post.id.in_(ids)).order_by(Post.date_posted.desc(), Post.id.desc())
+                    return render_template('home.html', posts=[feed_post(row) for row in cards], next_url=older_url)
+                write_if_changed(f"{name}.html", signature, build_page)
+                if name == 'index':
+                    write_if_changed('home.html', signature, build_page)
+
+            newest = rows[-ATOM_ENTRIES:][::-1]
+
+            def build_atom():
+                posts = (
+                    db.session.query(Post).options(joinedload(Post.author))
+                    .filter(Post.id.in_([row.id for row in newest]))
+                    .order_by(Post.date_posted.desc(), Post.id.desc())
+                    .all()
+                )
+                entries = [
+                    (post, post.content_html if post.content_html is not None else str(escape(post.content)))
+                    for post in posts
+                ]
+                updated = max((row.stamp for row in newest), default=None)
+                return render_template(
+                    'export/atom.xml', entries=entries, updated=updated, site_url=site_url, rfc3339=rfc3339)
+            write_if_changed('feed.atom', _signature(*(f"{row.id}:{stamps[str(row.id)]}" for row in newest)), build_atom)
+
+            by_id = sorted(rows, key=lambda row: row.id)
+            chunks = [by_id[start:start + SITEMAP_CHUNK_SIZE] for start in range(0, len(by_id), SITEMAP_CHUNK_SIZE)] or [[]]
+            sitemaps = []
+            for number, chunk in enumerate(chunks, 1):
+                name = f"sitemap-{number}.xml"
+                signature = _signature(*(f"{row.id}:{stamps[str(row.id)]}" for row in chunk))
+                lastmod = max((row.stamp for row in chunk), default=None)
+                sitemaps.append((name, lastmod))
+
+                def build_sitemap(chunk=chunk, include_home=(number == 1)):
+                    return render_template(
+                        'export/sitemap.xml', rows=chunk, include_home=include_home, site_url=site_url, rfc3339=rfc3339)
+                write_if_changed(name, signature, build_sitemap)
+            write_if_changed(
+                'sitemap.xml',
+                _signature(*(f"{name}:{files[name]}" for name, _ in sitemaps)),
+                lambda: render_template(
+                    'export/sitemap_index.xml', sitemaps=sitemaps, site_url=site_url, rfc3339=rfc3339),
+            )
+
+        for name in previous.get('files', {}):
+            if name not in files:
+                _remove(os.path.join(directory, name))
+                summary['files_removed'] += 1
+        summary['static_copied'] = _sync_static(app.static_folder, os.path.join(directory, 'static'))
+
+        manifest = {'signature': site_signature, 'exported_at': rfc3339(datetime.utcnow()), 'posts': stamps, 'files': files}
+        _write(manifest_path, json.dumps(manifest, separators=(',', ':')))
+        summary['elapsed_ms'] = round((time.perf_counter() - started) * 1000, 1)
+        return summary
+
+    # Re-export in the background after a write, if EXPORT_ON_WRITE is enabled
+    def schedule(self):
+        if current_app.config.get('EXPORT_ON_WRITE'):
+            job_queue.enqueue('export', coalesce=True)
+
+
+exporter = StaticExporter()
+
+
+# Background job behind schedule(); concurrent runs are serialized by the directory lock
+@job_queue.task('export', max_attempts=3)
+def export_job():
+    exporter.export()
+
+
+# `flask export`: write the public pages, Atom feed and sitemaps as static files
+@click.command('export')
+@click.option('--dir', 'directory', help='Output directory (default: EXPORT_DIR or instance/export).')
+@click.option('--full', is_flag=True, help='Rewrite every file instead of only what changed.')
+@with_appcontext
+def export_command(directory, full):
+    summary = exporter.export(directory, full=full)
+    click.echo(
+        f"Exported {summary['posts_written']} posts and {summary['files_written']} other files, "
+        f"removed {summary['posts_removed'] + summary['files_removed']}, in {summary['elapsed_ms']} ms."
+    )
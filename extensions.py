@@ -1,20 +1,112 @@
-# Import necessary classes and functions from the flask_sqlalchemy, flask_bcrypt, and flask_login packages
+# Import necessary classes and functions from the flask_sqlalchemy and flask_login packages
+from functools import wraps
+from flask import g
+from sqlalchemy import event
 from flask_sqlalchemy import SQLAlchemy  # Import the SQLAlchemy class for database interactions
-from flask_bcrypt import Bcrypt  # Import the Bcrypt class for password hashing
+from flask_sqlalchemy.session import Session
 from flask_login import LoginManager
+from cache import ChangeMarkers, PageCache  # Import the change-marker and page-cache classes
+from hashing import PasswordHasher  # Import the PasswordHasher class for off-thread password hashing
+from metrics import Metrics  # Import the Metrics class for request-level performance instrumentation
+from ratelimit import RateLimiter  # Import the RateLimiter class for throttling login and registration
 # Import various utilities and classes from flask_login for user session management
 
+
+
+# Session that sends reads to the 'replica' bind while a read-only view is running.
+# Flushes (and therefore every write) always go to the primary.
+class RoutingSession(Session):
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and not self._flushing and g and g.get('use_read_replica'):
+            replica = self._db.engines.get('replica')
+            if replica is not None:
+                return replica
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
 # Initialize a new SQLAlchemy instance which will be used to interact with the database
-db = SQLAlchemy()
+db = SQLAlchemy(session_options={'class_': RoutingSession})
+
+
+# Decorator marking a view as read-only so its queries may be served by the read replica
+def read_only(view):
+    @wraps(view)
+    def decorated_function(*args, **kwargs):
+        g.use_read_replica = True
+        return view(*args, **kwargs)
+    return decorated_function
+
+
+# Apply the PRAGMAs from the engine profile to each new SQLite connection
+def _sqlite_pragmas(config):
+    pragmas = [
+        f"PRAGMA journal_mode={config['SQLITE_JOURNAL_MODE']}",
+        f"PRAGMA synchronous={config['SQLITE_SYNCHRONOUS']}",
+        f"PRAGMA busy_timeout={int(config['SQLITE_BUSY_TIMEOUT_MS'])}",
+        f"PRAGMA mmap_size={int(config['SQLITE_MMAP_SIZE'])}",
+        f"PRAGMA cache_size={int(config['SQLITE_CACHE_SIZE'])}",
+    ]
+
+    def on_connect(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for pragma in pragmas:
+            cursor.execute(pragma)
+        cursor.close()
+    return on_connect
+
+
+# Engine options for the configured profile, merged under any explicit SQLALCHEMY_ENGINE_OPTIONS
+def _engine_options(config, uri):
+    if config.get('DB_ENGINE_PROFILE') != 'tuned' or not uri or uri.startswith('sqlite'):
+        return {}
+    return {
+        'pool_size': config['DB_POOL_SIZE'],
+        'max_overflow': config['DB_MAX_OVERFLOW'],
+        'pool_timeout': config['DB_POOL_TIMEOUT'],
+        'pool_recycle': config['DB_POOL_RECYCLE'],
+        'pool_pre_ping': config['DB_POOL_PRE_PING'],
+    }
+
+
+# Initialize the db extension for an app with the engine profile from its config
+def init_db(app):
+    config = app.config
+    options = {**_engine_options(config, config['SQLALCHEMY_DATABASE_URI']), **config.get('SQLALCHEMY_ENGINE_OPTIONS', {})}
+    config['SQLALCHEMY_ENGINE_OPTIONS'] = options
+    binds = {}
+    for key, bind in config.get('SQLALCHEMY_BINDS', {}).items():
+        if isinstance(bind, str):
+            bind = {'url': bind, **_engine_options(config, bind)}
+        binds[key] = bind
+    config['SQLALCHEMY_BINDS'] = binds
+    db.init_app(app)
+
+    if config.get('DB_ENGINE_PROFILE') == 'tuned':
+        with app.app_context():
+            for engine in db.engines.values():
+                if engine.dialect.name == 'sqlite':
+                    event.listen(engine, 'connect', _sqlite_pragmas(config))
+
+# Initialize a new PasswordHasher instance which will run bcrypt work on a bounded worker pool
+password_hasher = PasswordHasher()
+
+# Initialize a new Metrics instance which will record timings and query counts and serve /metrics
+metrics = Metrics()
+
+# Initialize a new ChangeMarkers instance which will tell every worker process which cached data has changed
+change_markers = ChangeMarkers()
+
+# Initialize a new PageCache instance which will cache rendered pages for anonymous visitors
+page_cache = PageCache()
 
-# Initialize a new Bcrypt instance which will be used for hashing passwords
-bcrypt = Bcrypt()
+# Initialize a new RateLimiter instance which will throttle login, registration and other expensive endpoints
+rate_limiter = RateLimiter()
 
 # Initialize a new LoginManager instance which will handle user session management
 login_manager = LoginManager()
 
-# Set the default login view to 'login', meaning that any route requiring authentication will redirect to the 'login' route if the user is not authenticated
-login_manager.login_view = 'login'
+# Set the default login view to 'blog.login', meaning that any route requiring authentication will redirect to the 'login' route if the user is not authenticated
+login_manager.login_view = 'blog.login'
 
 # Set the default flash message category to 'info' for messages displayed by Flask-Login
 login_manager.login_message_category = 'info'
@@ -0,0 +1,67 @@
+from collections import namedtuple  # Lightweight containers for feed pages
+from datetime import datetime  # Used to parse the date part of a cursor
+from sqlalchemy import func, tuple_  # SQL functions and row-value comparisons
+from extensions import db  # Import the db instance from the extensions module
+from model import Post, User  # Models the feed reads from
+from render import EXCERPT_LENGTH  # Length of the stored plain-text excerpts
+
+# A page of the feed: the card rows plus the cursor for the next (older) page, or None on the last page
+FeedPage = namedtuple('FeedPage', ['posts', 'next_cursor'])
+
+# A single feed card, holding only the columns the card renders
+FeedPost = namedtuple('FeedPost', ['id', 'title', 'date_posted', 'excerpt', 'author_username'])
+
+
+# Encode the (date_posted, id) position of a post as an opaque cursor string
+def encode_cursor(date_posted, post_id):
+    return f"{date_posted.isoformat()}_{post_id}"
+
+
+# Decode a cursor back into (date_posted, id); raises ValueError if it is malformed
+def decode_cursor(cursor):
+    date_part, _, id_part = cursor.rpartition('_')
+    if not date_part:
+        raise ValueError(f"Invalid feed cursor: {cursor!r}")
+    return datetime.fromisoformat(date_part), int(id_part)
+
+
+# Query for feed cards in a single joined query.
+# Only the card columns are selected, using the excerpt stored when the post was written,
+# so full Text bodies never leave SQL and no per-post author lookups are needed.
+def card_query():
+    return db.session.query(
+        Post.id,
+        Post.title,
+        Post.date_posted,
+        # Posts not rendered yet fall back to the start of the raw body, one extra character showing truncation
+        func.coalesce(Post.excerpt, func.substr(Post.content, 1, EXCERPT_LENGTH + 1)).label('excerpt'),
+        User.username.label('author_username'),
+    ).join(User, Post.user_id == User.id)
+
+
+# Turn a row from card_query() into a FeedPost
+def feed_post(row):
+    excerpt = row.excerpt
+    if len(excerpt) > EXCERPT_LENGTH:
+        excerpt = excerpt[:EXCERPT_LENGTH].rstrip() + '…'
+    return FeedPost(row.id, row.title, row.date_posted, excerpt, row.author_username)
+
+
+# Fetch one page of the feed, newest first
+def get_feed_page(before=None, limit=20):
+    query = card_query()
+
+    # Keyset pagination: continue strictly after the cursor position using the (date_posted, id) index
+    if before:
+        date_posted, post_id = decode_cursor(before)
+        query = query.filter(tuple_(Post.date_posted, Post.id) < tuple_(date_posted, post_id))
+
+    # Ask for one row more than the page size to find out if there is a next page
+    rows = query.order_by(Post.date_posted.desc(), Post.id.desc()).limit(limit + 1).all()
+    posts = [feed_post(row) for row in rows[:limit]]
+
+    next_cursor = None
+    if len(rows) > limit:
+        last = posts[-1]
+        next_cursor = encode_cursor(last.date_posted, last.id)
+    return FeedPage(posts, next_cursor)
@@ -0,0 +1,110 @@
+import os  # Used to size the pool from the CPU count and to detect forks
+import threading  # Semaphore bounding the number of queued hashing jobs
+import time  # Used to time hashing calls for instrumentation
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+import bcrypt  # The bcrypt library; its C code releases the GIL while hashing
+
+
+# Raised when the hashing pool is saturated, so the request can be rejected instead of queueing
+class HasherBusy(Exception):
+    pass
+
+
+# Hash a password at the given cost; module level so it can run in a worker process too
+def _hash_password(password, rounds):
+    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(rounds)).decode('utf-8')
+
+
+# Check a password against a stored hash; module level so it can run in a worker process too
+def _check_password(pw_hash, password):
+    return bcrypt.checkpw(password.encode('utf-8'), pw_hash.encode('utf-8'))
+
+
+# Return the cost factor a bcrypt hash was generated with, e.g. 12 for '$2b$12$...'
+def hash_cost(pw_hash):
+    try:
+        return int(pw_hash.split('$')[2])
+    except (IndexError, ValueError):
+        return None
+
+
+# Runs bcrypt hashing and verification on a dedicated, size-capped pool instead of the request thread.
+# At most max_pending jobs may be queued or running; beyond that calls fail fast with HasherBusy.
+class PasswordHasher:
+    def __init__(self, app=None):
+        self.listeners = []  # Callables given the seconds each hash/check call took, e.g. for metrics
+        self.configure()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.configure(
+            rounds=app.config.get('BCRYPT_LOG_ROUNDS', 12),
+            workers=app.config.get('PASSWORD_HASH_WORKERS'),
+            max_pending=app.config.get('PASSWORD_HASH_MAX_PENDING'),
+            timeout=app.config.get('PASSWORD_HASH_TIMEOUT', 10),
+            executor=app.config.get('PASSWORD_HASH_EXECUTOR', 'thread'),
+        )
+        app.extensions['password_hasher'] = self
+
+    def configure(self, rounds=12, workers=None, max_pending=None, timeout=10, executor='thread'):
+        self.rounds = rounds
+        self.workers = workers or os.cpu_count() or 1
+        self.max_pending = max_pending or self.workers * 4
+        self.timeout = timeout
+        self.executor_kind = executor
+        self.rejected = 0  # Calls turned away because the pool was saturated
+        self._slots = threading.BoundedSemaphore(self.max_pending)
+        self._executor = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    # The pool is created on first use, and again after a fork, since worker threads don't survive fork()
+    def _get_executor(self):
+        if self._executor is None or self._pid != os.getpid():
+            with self._lock:
+                if self._executor is None or self._pid != os.getpid():
+                    pool_class = ProcessPoolExecutor if self.executor_kind == 'process' else ThreadPoolExecutor
+                    self._executor = pool_class(max_workers=self.workers)
+                    self._pid = os.getpid()
+        return self._executor
+
+    def _run(self, fn, *args):
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self.rejected += 1
+            raise HasherBusy()
+        try:
+            future = self._get_executor().submit(fn, *args)
+        except Exception:
+            self._slots.release()
+            raise
+        # The slot is freed when the job finishes, even if the caller gave up waiting on it
+        future.add_done_callback(lambda _: self._slots.release())
+        started = time.perf_counter()
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeoutError:
+            raise HasherBusy()
+        finally:
+            elapsed = time.perf_counter() - started
+            for listener in self.listeners:
+                listener(elapsed)
+
+    # Hash a password at the configured cost
+    def hash(self, password):
+        return self._run(_hash_password, password, self.rounds)
+
+    # Verify a password against a stored hash
+    def check(self, pw_hash, password):
+        return self._run(_check_password, pw_hash, password)
+
+    # True when a stored hash was made at a cost other than the configured one
+    def needs_rehash(self, pw_hash):
+        return hash_cost(pw_hash) != self.rounds
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
@@ -0,0 +1,311 @@
+import json
+import os
+import random
+import signal
+import socket
+import threading
+from datetime import datetime, timedelta
+import click
+from flask import current_app
+from flask.cli import AppGroup, with_appcontext
+from sqlalchemy import and_, delete, func, or_, update
+from sqlalchemy.exc import IntegrityError
+from extensions import db
+from model import Job
+
+# Job states; queued jobs wait for run_at, running ones hold a lease until locked_until
+JOB_STATUSES = ('queued', 'running', 'done', 'failed')
+
+# Finished jobs looked at for the wait and run time quantiles in stats()
+STATS_WINDOW = timedelta(hours=1)
+STATS_MAX_JOBS = 1000
+
+
+# Value at quantile q of an already sorted list
+def _quantile(values, q):
+    if not values:
+        return None
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+# Durable job queue kept in the `job` table of the application database, so no broker is needed.
+# Feature modules register tasks with @job_queue.task('name'); routes call enqueue() and return straight away,
+# and `flask worker` runs the jobs in worker threads. A worker claims a due job with a compare-and-set UPDATE,
+# so several worker processes can share one queue, and holds it under a lease: if the worker dies, the job is
+# handed out again once JOBS_LEASE_SECONDS have passed. A failed job is retried with exponential backoff and
+# jitter until it has been tried max_attempts times; tasks must therefore be safe to run more than once.
+# With JOBS_INLINE (development and tests) enqueue() runs the task immediately instead.
+class JobQueue:
+    def __init__(self, app=None):
+        self.tasks = {}
+        self.inline = False
+        self.lease = 300
+        self.backoff_base = 5
+        self.backoff_max = 3600
+        self._lock = threading.Lock()
+        self.processed = {'done': 0, 'retried': 0, 'failed': 0}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.inline = app.config.get('JOBS_INLINE', False)
+        self.lease = app.config.get('JOBS_LEASE_SECONDS', 300)
+        self.backoff_base = app.config.get('JOBS_BACKOFF_BASE', 5)
+        self.backoff_max = app.config.get('JOBS_BACKOFF_MAX', 3600)
+        app.extensions['jobs'] = self
+
+    # Decorator registering a function as the task `name`; it is called with the job payload as keyword arguments
+    def task(self, name, max_attempts=5):
+        def decorator(function):
+            self.tasks[name] = (function, max_attempts)
+            return function
+        return decorator
+
+    # Queue the task `name` with a JSON-serializable payload, committing the current session. Returns the Job.
+    # key: an idempotency key; while a job with the same key exists (until pruned), that job is returned instead,
+    # except that a failed one is put back in the queue with fresh attempts, so asking again retries the work.
+    # coalesce: skip if a job for the same task is already waiting to start (it will see the latest data anyway).
+    # delay: seconds before the job may run.
+    def enqueue(self, name, payload=None, key=None, coalesce=False, delay=0):
+        function, max_attempts = self.tasks[name]
+        if self.inline:
+            function(**(payload or {}))
+            return None
+        if key is not None:
+            existing = Job.query.filter_by(idempotency_key=key).first()
+            if existing is not None and existing.status == 'failed':
+                db.session.execute(
+                    update(Job).where(Job.id == existing.id, Job.status == 'failed').values(
+                        status='queued', attempts=0, max_attempts=max_attempts, payload=json.dumps(payload or {}),
+                        run_at=datetime.utcnow() + timedelta(seconds=delay), finished_at=None,
+                    ),
+                    execution_options={'synchronize_session': False},
+                )
+                db.session.commit()
+                db.session.refresh(existing)
+            if existing is not None:
+                return existing
+        if coalesce:
+            existing = Job.query.filter_by(name=name, status='queued').order_by(Job.id).first()
+            if existing is not None:
+                return existing
+        job = Job(
+            name=name,
+            payload=json.dumps(payload or {}),
+            idempotency_key=key,
+            max_attempts=max_attempts,
+            run_at=datetime.utcnow() + timedelta(seconds=delay),
+        )
+        db.session.add(job)
+        try:
+            db.session.commit()
+        except IntegrityError:
+            # Another request enqueued the same key in the meantime
+            db.session.rollback()
+            return Job.query.filter_by(idempotency_key=key).one()
+        return job
+
+    # Jobs a worker may take: queued and due, or running under a lease that has run out
+    @staticmethod
+    def _claimable(now):
+        return or_(
+            and_(Job.status == 'queued', Job.run_at <= now),
+            and_(Job.status == 'running', Job.locked_until < now),
+        )
+
+    # Take the next due job for worker_id, or return None. The UPDATE only succeeds if nobody else took the job
+    # since it was read, because a claim increments attempts.
+    def claim(self, worker_id):
+        now = datetime.utcnow()
+        candidates = (
+            db.session.query(Job.id, Job.attempts, Job.max_attempts, Job.status)
+            .filter(self._claimable(now))
+            .order_by(Job.run_at, Job.id)
+            .limit(10)
+            .all()
+        )
+        for candidate in candidates:
+            claim = and_(Job.id == candidate.id, Job.attempts == candidate.attempts, self._claimable(now))
+            if candidate.status == 'running' and candidate.attempts >= candidate.max_attempts:
+                # Its last attempt never finished, most likely because it keeps killing the worker
+                db.session.execute(
+                    update(Job).where(claim).values(
+                        status='failed', finished_at=now, locked_by=None, last_error='Lease expired on the last attempt'
+                    )
+                )
+                db.session.commit()
+                continue
+            result = db.session.execute(
+                update(Job).where(claim).values(
+                    status='running',
+                    attempts=Job.attempts + 1,
+                    locked_by=worker_id,
+                    locked_until=now + timedelta(seconds=self.lease),
+                    started_at=now,
+                )
+            )
+            db.session.commit()
+            if result.rowcount:
+                return db.session.get(Job, candidate.id)
+        return None
+
+    def _backoff(self, attempts):
+        delay = min(self.backoff_max, self.backoff_base * 2 ** (attempts - 1))
+        return delay * random.uniform(0.5, 1.0)
+
+    # Run a claimed job and record the outcome, unless the lease was lost to another worker meanwhile
+    def run(self, job, worker_id):
+        app = current_app._get_current_object()
+        job_id, name, attempts, max_attempts = job.id, job.name, job.attempts, job.max_attempts
+        values = {'locked_by': None, 'locked_until': None}
+        try:
+            if name not in self.tasks:
+                raise LookupError(f"Unknown task {name!r}")
+            self.tasks[name][0](**json.loads(job.payload))
+        except Exception as error:
+            db.session.rollback()
+            app.logger.exception('Job %s (%s) failed on attempt %s of %s', job_id, name, attempts, max_attempts)
+            values['last_error'] = f"{type(error).__name__}: {error}"[:2000]
+            if attempts >= max_attempts or name not in self.tasks:
+                values.update(status='failed', finished_at=datetime.utcnow())
+                outcome = 'failed'
+            else:
+                values.update(status='queued', run_at=datetime.utcnow() + timedelta(seconds=self._backoff(attempts)))
+                outcome = 'retried'
+        else:
+            values.update(status='done', finished_at=datetime.utcnow(), last_error=None)
+            outcome = 'done'
+        db.session.execute(
+            update(Job)
+            .where(Job.id == job_id, Job.locked_by == worker_id, Job.attempts == attempts)
+            .values(**values)
+        )
+        db.session.commit()
+        with self._lock:
+            self.processed[outcome] += 1
+        return outcome
+
+    # Run jobs in `concurrency` threads until SIGINT/SIGTERM (letting running jobs finish),
+    # or, with burst, until no job is due
+    def work(self, app, concurrency=1, poll_interval=1.0, burst=False):
+        stop = threading.Event()
+        prefix = f"{socket.gethostname()}:{os.getpid()}"
+
+        def loop(worker_id):
+            while not stop.is_set():
+                with app.app_context():
+                    job = self.claim(worker_id)
+                    if job is not None:
+                        self.run(job, worker_id)
+                        continue
+                if burst:
+                    return
+                stop.wait(poll_interval)
+
+        if threading.current_thread() is threading.main_thread():
+            for signum in (signal.SIGINT, signal.SIGTERM):
+                signal.signal(signum, lambda signum, frame: stop.set())
+        threads = [
+            threading.Thread(target=loop, args=(f"{prefix}:{index}",), name=f"job-worker-{index}", daemon=True)
+            for index in range(concurrency)
+        ]
+        for thread in threads:
+            thread.start()
+        while any(thread.is_alive() for thread in threads):
+            for thread in threads:
+                thread.join(timeout=0.5)
+        return dict(self.processed)
+
+    # Queue depth by status, age of the oldest due job, and wait (due until started) and run time quantiles
+    # over jobs finished in the last hour
+    def stats(self):
+        now = datetime.utcnow()
+        depth = dict.fromkeys(JOB_STATUSES, 0)
+        depth.update(db.session.query(Job.status, func.count(Job.id)).group_by(Job.status).all())
+        oldest = db.session.query(func.min(Job.run_at)).filter(Job.status == 'queued', Job.run_at <= now).scalar()
+        recent = (
+            db.session.query(Job.run_at, Job.started_at, Job.finished_at)
+            .filter(Job.status == 'done', Job.finished_at >= now - STATS_WINDOW)
+            .order_by(Job.finished_at.desc())
+            .limit(STATS_MAX_JOBS)
+            .all()
+        )
+        waits = sorted(max(0.0, (row.started_at - row.run_at).total_seconds()) for row in recent)
+        runs = sorted((row.finished_at - row.started_at).total_seconds() for row in recent)
+        return {
+            'depth': depth,
+            'oldest_due_seconds': (now - oldest).total_seconds() if oldest else 0.0,
+            'wait_seconds': {q: _quantile(waits, q) for q in (0.5, 0.95, 0.99)},
+            'run_seconds': {q: _quantile(runs, q) for q in (0.5, 0.95, 0.99)},
+            'finished_recently': len(recent),
+        }
+
+    # Delete done jobs finished more than `older_than` ago (and failed ones too, with include_failed)
+    def prune(self, older_than, include_failed=False):
+        statuses = ['done', 'failed'] if include_failed else ['done']
+        result = db.session.execute(
+            delete(Job).where(Job.status.in_(statuses), Job.finished_at < datetime.utcnow() - older_than),
+            execution_options={'synchronize_session': False},
+        )
+        db.session.commit()
+        return result.rowcount
+
+    # Put failed jobs back in the queue for another round of attempts
+    def retry_failed(self, name=None):
+        query = update(Job).where(Job.status == 'failed')
+        if name:
+            query = query.where(Job.name == name)
+        result = db.session.execute(
+            query.values(status='queued', attempts=0, run_at=datetime.utcnow(), finished_at=None),
+            execution_options={'synchronize_session': False},
+        )
+        db.session.commit()
+        return result.rowcount
+
+
+job_queue = JobQueue()
+
+
+# `flask worker`: run queued jobs until interrupted
+@click.command('worker')
+@click.option('--concurrency', type=int, help='Jobs run at once (default: JOBS_CONCURRENCY).')
+@click.option('--poll-interval', type=float, help='Seconds between polls of an empty queue (default: JOBS_POLL_INTERVAL).')
+@click.option('--burst', is_flag=True, help='Exit once no job is due instead of waiting for more.')
+@with_appcontext
+def worker_command(concurrency, poll_interval, burst):
+    app = current_app._get_current_object()
+    concurrency = concurrency or app.config['JOBS_CONCURRENCY']
+    poll_interval = poll_interval or app.config['JOBS_POLL_INTERVAL']
+    click.echo(f"Worker started with {concurrency} threads; tasks: {', '.join(sorted(job_queue.tasks))}", err=True)
+    processed = job_queue.work(app, concurrency, poll_interval, burst)
+    click.echo(f"Worker stopped: {processed['done']} done, {processed['retried']} retried, {processed['failed']} failed.", err=True)
+
+
+# `flask jobs ...` commands for inspecting and maintaining the queue
+jobs_cli = AppGroup('jobs', help='Inspect and maintain the background job queue.')
+
+
+@jobs_cli.command('stats')
+def stats_command():
+    stats = job_queue.stats()
+    click.echo(' '.join(f"{status}={count}" for status, count in stats['depth'].items()))
+    click.echo(f"oldest due job waiting: {stats['oldest_due_seconds']:.1f}s")
+    for label in ('wait_seconds', 'run_seconds'):
+        values = ', '.join(
+            f"p{round(q * 100)}={value:.3f}s" if value is not None else f"p{round(q * 100)}=-"
+            for q, value in stats[label].items()
+        )
+        click.echo(f"{label.replace('_seconds', '')} (last hour, {stats['finished_recently']} jobs): {values}")
+
+
+@jobs_cli.command('prune')
+@click.option('--days', default=7, show_default=True, help='Delete finished jobs older than this.')
+@click.option('--failed', is_flag=True, help='Delete failed jobs too.')
+def prune_command(days, failed):
+    click.echo(f"Deleted {job_queue.prune(timedelta(days=days), include_failed=failed)} jobs.")
+
+
+@jobs_cli.command('retry')
+@click.option('--name', help='Only jobs for this task.')
+def retry_command(name):
+    click.echo(f"Requeued {job_queue.retry_failed(name)} failed jobs.")
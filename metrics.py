@@ -0,0 +1,251 @@
+import cProfile
+import io
+import os
+import pstats
+import threading
+import time
+from flask import abort, current_app, g, has_request_context, request, request_finished, request_started
+from flask import before_render_template, template_rendered
+from sqlalchemy import event
+
+# Upper bounds (seconds) of the latency histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Upper bounds of the queries-per-request histogram buckets
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+
+# Prometheus-style histogram with one series per label set
+class Histogram:
+    def __init__(self, name, help_text, labels, buckets):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self.buckets = buckets
+        self._series = {}
+
+    def observe(self, label_values, value):
+        series = self._series.get(label_values)
+        if series is None:
+            series = self._series[label_values] = [[0] * len(self.buckets), 0.0, 0]
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                series[0][index] += 1
+        series[1] += value
+        series[2] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        for label_values, (counts, total, count) in sorted(self._series.items()):
+            labels = _format_labels(self.labels, label_values)
+            for bound, bucket_count in zip(self.buckets, counts):
+                lines.append(f'{self.name}_bucket{{{labels}{"," if labels else ""}le="{bound}"}} {bucket_count}')
+            lines.append(f'{self.name}_bucket{{{labels}{"," if labels else ""}le="+Inf"}} {count}')
+            lines.append(f"{self.name}_sum{{{labels}}} {total}")
+            lines.append(f"{self.name}_count{{{labels}}} {count}")
+        return lines
+
+
+# Prometheus-style counter with one series per label set
+class Counter:
+    def __init__(self, name, help_text, labels):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self._series = {}
+
+    def inc(self, label_values, amount=1):
+        self._series[label_values] = self._series.get(label_values, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        for label_values, value in sorted(self._series.items()):
+            lines.append(f"{self.name}{{{_format_labels(self.labels, label_values)}}} {value}")
+        return lines
+
+
+# Render label pairs, escaping values as the text exposition format requires
+def _format_labels(names, values):
+    def escape(value):
+        return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    return ','.join(f'{name}="{escape(value)}"' for name, value in zip(names, values))
+
+
+# Request-level performance instrumentation for a Flask app:
+# - per-endpoint latency, SQL statement counts and SQL time, from Flask request signals and engine events
+# - template render time, and the SQL issued while each template renders (lazy loads such as post.author)
+# - time spent waiting on bcrypt in the password hasher
+# - requests allowed and rejected by the rate limiter, by endpoint and scope
+# - background job queue depth and wait/run time quantiles, read from the job table when scraped
+# All of it is served in Prometheus text format at /metrics. Values are per worker process.
+#
+# PROFILING_ENABLED lets a request carrying `X-Profile: 1` run under cProfile; the stats are written to
+# PROFILE_DIR and the top functions are logged. With app.debug or QUERY_COUNT_WARNINGS on, any request
+# issuing more than QUERY_COUNT_WARN_THRESHOLD statements logs a warning.
+class Metrics:
+    def __init__(self, app=None):
+        self._lock = threading.Lock()
+        self.request_latency = Histogram(
+            'http_request_duration_seconds', 'Request latency by endpoint.', ('endpoint', 'method'), LATENCY_BUCKETS)
+        self.requests = Counter('http_requests_total', 'Requests by endpoint and status.', ('endpoint', 'method', 'status'))
+        self.request_queries = Histogram(
+            'db_queries_per_request', 'SQL statements issued per request.', ('endpoint',), QUERY_COUNT_BUCKETS)
+        self.query_seconds = Counter('db_query_seconds_total', 'Time spent executing SQL by endpoint.', ('endpoint',))
+        self.template_latency = Histogram(
+            'template_render_seconds', 'Template render time.', ('template',), LATENCY_BUCKETS)
+        self.template_queries = Counter(
+            'db_queries_in_template_total', 'SQL statements issued while rendering a template (lazy loads).', ('template',))
+        self.hash_latency = Histogram(
+            'password_hash_seconds', 'Time requests spent waiting on bcrypt.', ('endpoint',), LATENCY_BUCKETS)
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.extensions['metrics'] = self
+        request_started.connect(self._request_started, app)
+        request_finished.connect(self._request_finished, app)
+        before_render_template.connect(self._template_started, app)
+        template_rendered.connect(self._template_finished, app)
+        app.after_request(self._finish_profile)
+
+        with app.app_context():
+            for engine in app.extensions['sqlalchemy'].engines.values():
+                event.listen(engine, 'before_cursor_execute', self._before_cursor_execute)
+                event.listen(engine, 'after_cursor_execute', self._after_cursor_execute)
+                event.listen(engine, 'handle_error', self._handle_error)
+
+        hasher = app.extensions.get('password_hasher')
+        # The hasher is shared by every app built in the process, so only listen once
+        if hasher is not None and self._hash_finished not in hasher.listeners:
+            hasher.listeners.append(self._hash_finished)
+
+        if app.config.get('METRICS_ENABLED', True):
+            app.add_url_rule('/metrics', 'metrics', self._metrics_view)
+
+    def _request_started(self, sender, **extra):
+        g.metrics = {'start': time.perf_counter(), 'queries': 0, 'query_seconds': 0.0, 'templates': []}
+        if sender.config.get('PROFILING_ENABLED') and request.headers.get('X-Profile') == '1':
+            g.profiler = cProfile.Profile()
+            g.profiler.enable()
+
+    # request_finished fires before a streamed body (stream_template) has been produced, so the request is
+    # recorded when the server closes the response, once every statement issued while streaming has been counted
+    def _request_finished(self, sender, response, **extra):
+        state = g.get('metrics')
+        if state is None:
+            return
+        endpoint, method, path = request.endpoint or 'unmatched', request.method, request.path
+        status = response.status_code
+        response.call_on_close(lambda: self._record(sender, state, endpoint, method, path, status))
+
+    def _record(self, app, state, endpoint, method, path, status):
+        elapsed = time.perf_counter() - state['start']
+        with self._lock:
+            self.request_latency.observe((endpoint, method), elapsed)
+            self.requests.inc((endpoint, method, status))
+            self.request_queries.observe((endpoint,), state['queries'])
+            self.query_seconds.inc((endpoint,), state['query_seconds'])
+
+        threshold = app.config.get('QUERY_COUNT_WARN_THRESHOLD')
+        if threshold and (app.debug or app.config.get('QUERY_COUNT_WARNINGS')) and state['queries'] > threshold:
+            app.logger.warning(
+                "%s %s issued %d SQL statements (threshold %d); look for lazy loads in loops",
+                method, path, state['queries'], threshold,
+            )
+
+    def _finish_profile(self, response):
+        profiler = g.pop('profiler', None)
+        if profiler is None:
+            return response
+        profiler.disable()
+        app = current_app._get_current_object()
+        directory = app.config.get('PROFILE_DIR') or os.path.join(app.instance_path, 'profiles')
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f"{request.endpoint or 'unmatched'}-{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}.prof")
+        profiler.dump_stats(path)  # Loadable by snakeviz, flameprof and similar flame-graph tools
+        summary = io.StringIO()
+        pstats.Stats(profiler, stream=summary).sort_stats('cumulative').print_stats(25)
+        app.logger.info("Profile for %s %s written to %s\n%s", request.method, request.path, path, summary.getvalue())
+        response.headers['X-Profile-File'] = os.path.basename(path)
+        return response
+
+    def _template_started(self, sender, template, context, **extra):
+        if has_request_context() and 'metrics' in g:
+            g.metrics['templates'].append((template.name, time.perf_counter()))
+
+    def _template_finished(self, sender, template, context, **extra):
+        if not (has_request_context() and 'metrics' in g and g.metrics['templates']):
+            return
+        name, started = g.metrics['templates'].pop()
+        with self._lock:
+            self.template_latency.observe((name,), time.perf_counter() - started)
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('metrics_query_start', []).append(time.perf_counter())
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        started = conn.info['metrics_query_start'].pop()
+        if not (has_request_context() and 'metrics' in g):
+            return
+        state = g.metrics
+        state['queries'] += 1
+        state['query_seconds'] += time.perf_counter() - started
+        if state['templates']:
+            with self._lock:
+                self.template_queries.inc((state['templates'][-1][0],))
+
+    # A failed statement never reaches after_cursor_execute, so drop its start time here
+    def _handle_error(self, context):
+        if context.connection is not None and context.execution_context is not None:
+            starts = context.connection.info.get('metrics_query_start')
+            if starts:
+                starts.pop()
+
+    def _hash_finished(self, seconds):
+        if has_request_context():
+            with self._lock:
+                self.hash_latency.observe((request.endpoint or 'unmatched',), seconds)
+
+    def render(self):
+        with self._lock:
+            lines = []
+            for metric in (self.request_latency, self.requests, self.request_queries, self.query_seconds,
+                           self.template_latency, self.template_queries, self.hash_latency):
+                lines.extend(metric.render())
+        app = current_app
+        user_cache = app.extensions.get('user_cache')
+        if user_cache is not None:
+            stats = user_cache.stats()
+            lines.append('# TYPE user_cache_hits_total counter')
+            lines.append(f"user_cache_hits_total {stats['hits']}")
+            lines.append('# TYPE user_cache_misses_total counter')
+            lines.append(f"user_cache_misses_total {stats['misses']}")
+        hasher = app.extensions.get('password_hasher')
+        if hasher is not None:
+            lines.append('# TYPE password_hash_rejected_total counter')
+            lines.append(f"password_hash_rejected_total {hasher.rejected}")
+        rate_limiter = app.extensions.get('rate_limiter')
+        if rate_limiter is not None:
+            lines.append('# TYPE rate_limit_requests_total counter')
+            for (name, scope, outcome), count in sorted(rate_limiter.stats().items()):
+                lines.append(f'rate_limit_requests_total{{{_format_labels(("endpoint", "scope", "outcome"), (name, scope, outcome))}}} {count}')
+        jobs = app.extensions.get('jobs')
+        if jobs is not None and not jobs.inline:
+            stats = jobs.stats()
+            lines.append('# TYPE job_queue_depth gauge')
+            for status, count in stats['depth'].items():
+                lines.append(f'job_queue_depth{{status="{status}"}} {count}')
+            lines.append('# TYPE job_queue_oldest_due_seconds gauge')
+            lines.append(f"job_queue_oldest_due_seconds {stats['oldest_due_seconds']}")
+            for name in ('wait_seconds', 'run_seconds'):
+                lines.append(f"# TYPE job_{name} summary")
+                for q, value in stats[name].items():
+                    if value is not None:
+                        lines.append(f'job_{name}{{quantile="{q}"}} {value}')
+        return '\n'.join(lines) + '\n'
+
+    def _metrics_view(self):
+        token = current_app.config.get('METRICS_TOKEN')
+        if token and request.headers.get('Authorization') != f"Bearer {token}":
+            abort(403)
+        return self.render(), 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
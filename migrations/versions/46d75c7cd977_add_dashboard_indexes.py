@@ -0,0 +1,32 @@
+"""Add indexes for admin dashboard aggregates
+
+Revision ID: 46d75c7cd977
+Revises: ea2f882dc75d
+Create Date: 2026-10-18 14:26:51.302877
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '46d75c7cd977'
+down_revision = 'ea2f882dc75d'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('post', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_post_user_id'), ['user_id'], unique=False)
+
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_user_date_joined'), ['date_joined'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_user_date_joined'))
+
+    with op.batch_alter_table('post', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_post_user_id'))
@@ -0,0 +1,31 @@
+"""Add date_updated to post
+
+Revision ID: 540782b8cb84
+Revises: d432443eb93e
+Create Date: 2026-10-18 19:02:44.861203
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '540782b8cb84'
+down_revision = 'd432443eb93e'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('post', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('date_updated', sa.DateTime(), nullable=True))
+        batch_op.create_index(batch_op.f('ix_post_date_updated'), ['date_updated'], unique=False)
+
+    # Existing posts were last changed, as far as we know, when they were posted
+    op.execute('UPDATE post SET date_updated = date_posted')
+
+
+def downgrade():
+    with op.batch_alter_table('post', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_post_date_updated'))
+        batch_op.drop_column('date_updated')
@@ -0,0 +1,35 @@
+"""Add stored rendering columns to post
+
+Revision ID: d432443eb93e
+Revises: 46d75c7cd977
+Create Date: 2026-10-18 18:20:07.514390
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd432443eb93e'
+down_revision = '46d75c7cd977'
+branch_labels = None
+depends_on = None
+
+
+# Existing rows are left unrendered; run `flask posts render` afterwards to fill them in
+def upgrade():
+    with op.batch_alter_table('post', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('content_html', sa.Text(), nullable=True))
+        batch_op.add_column(sa.Column('excerpt', sa.Text(), nullable=True))
+        batch_op.add_column(sa.Column('content_hash', sa.String(length=64), nullable=True))
+        batch_op.add_column(sa.Column('renderer_version', sa.Integer(), nullable=True))
+        batch_op.create_index(batch_op.f('ix_post_renderer_version'), ['renderer_version'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('post', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_post_renderer_version'))
+        batch_op.drop_column('renderer_version')
+        batch_op.drop_column('content_hash')
+        batch_op.drop_column('excerpt')
+        batch_op.drop_column('content_html')
@@ -0,0 +1,50 @@
+"""Add full-text search index for posts
+
+Revision ID: ea2f882dc75d
+Revises: f2a84f6d2dea
+Create Date: 2026-10-18 11:03:27.540913
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = 'ea2f882dc75d'
+down_revision = 'f2a84f6d2dea'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    bind = op.get_bind()
+    dialect = bind.dialect.name
+    # The app creates the index on startup as well, so it may already be there
+    if sa.inspect(bind).has_table('post_search'):
+        return
+    if dialect == 'sqlite':
+        op.execute("CREATE VIRTUAL TABLE post_search USING fts5(title, content, tokenize='porter unicode61')")
+        op.execute("INSERT INTO post_search(post_search, rank) VALUES('rank', 'bm25(10.0, 1.0)')")
+        op.execute('INSERT INTO post_search (rowid, title, content) SELECT id, title, content FROM post')
+    elif dialect == 'postgresql':
+        op.create_table(
+            'post_search',
+            sa.Column('post_id', sa.Integer(), sa.ForeignKey('post.id', ondelete='CASCADE'), primary_key=True),
+            sa.Column('document', postgresql.TSVECTOR(), nullable=False),
+        )
+        op.create_index('ix_post_search_document', 'post_search', ['document'], postgresql_using='gin')
+        op.execute(
+            'INSERT INTO post_search (post_id, document) '
+            "SELECT id, setweight(to_tsvector('english', title), 'A') || setweight(to_tsvector('english', content), 'B') "
+            'FROM post'
+        )
+
+
+def downgrade():
+    dialect = op.get_bind().dialect.name
+    if dialect == 'sqlite':
+        op.execute('DROP TABLE post_search')
+    elif dialect == 'postgresql':
+        op.drop_index('ix_post_search_document', table_name='post_search')
+        op.drop_table('post_search')
@@ -0,0 +1,26 @@
+"""Add composite (date_posted, id) index for the post feed
+
+Revision ID: f2a84f6d2dea
+Revises: 544c556126a7
+Create Date: 2026-10-18 09:12:40.118204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f2a84f6d2dea'
+down_revision = '544c556126a7'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('post', schema=None) as batch_op:
+        batch_op.create_index('ix_post_date_posted_id', ['date_posted', 'id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('post', schema=None) as batch_op:
+        batch_op.drop_index('ix_post_date_posted_id')
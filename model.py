@@ -9,7 +9,7 @@ class User(db.Model, UserMixin):  # Inherit from db.Model and UserMixin
     username = db.Column(db.String(20), unique=True, nullable=False)  # Username column, must be unique and not null
     email = db.Column(db.String(120), unique=True, nullable=False)  # Email column, must be unique and not null
     image_file = db.Column(db.String(20), nullable=False, default='default.jpg')  # Image file column, default value is 'default.jpg'
-    date_joined = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    date_joined = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, index=True)  # Indexed for signups-per-day stats
     password = db.Column(db.String(60), nullable=False)  # Password column, not null
     posts = db.relationship('Post', backref='author', lazy=True)  # One-to-many relationship with Post
     is_admin = db.Column(db.Boolean, default=False)  # New field
@@ -23,9 +23,41 @@ class Post(db.Model):  # Inherit from db.Model
     id = db.Column(db.Integer, primary_key=True)  # Primary key column
     title = db.Column(db.String(100), nullable=False)  # Title column, not null
     date_posted = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)  # Date posted column, default value is current time
+    date_updated = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, index=True)  # Last change to the post or how it is displayed
     content = db.Column(db.Text, nullable=False)  # Content column, not null
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)  # Foreign key column, references User table
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)  # Foreign key column, references User table
+    # Rendering of content made when the post is written (see render.py), so views never convert or sanitize per request
+    content_html = db.Column(db.Text)  # Sanitized HTML rendered from the Markdown in content
+    excerpt = db.Column(db.Text)  # Plain-text excerpt shown on feed cards
+    content_hash = db.Column(db.String(64))  # SHA-256 of the content the rendering was made from
+    renderer_version = db.Column(db.Integer, index=True)  # Renderer that made it; older versions are re-rendered by `flask posts render`
+
+    # Composite index backing the keyset-paginated feed (newest first by date_posted, then id)
+    __table_args__ = (db.Index('ix_post_date_posted_id', 'date_posted', 'id'),)
 
     # Define how the Post object is printed
     def __repr__(self):
         return f"Post('{self.title}', '{self.date_posted}')"
+
+# A unit of background work, stored in the database and run by `flask worker` (see jobs.py)
+class Job(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(64), nullable=False)  # Registered task name
+    payload = db.Column(db.Text, nullable=False, default='{}')  # JSON keyword arguments for the task
+    status = db.Column(db.String(16), nullable=False, default='queued')  # queued, running, done or failed
+    idempotency_key = db.Column(db.String(128), unique=True)  # Enqueueing again with the same key returns this job
+    attempts = db.Column(db.Integer, nullable=False, default=0)  # Times a worker has picked it up
+    max_attempts = db.Column(db.Integer, nullable=False, default=5)
+    run_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)  # Not run before this (retry backoff)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+    locked_by = db.Column(db.String(64))  # Worker running it
+    locked_until = db.Column(db.DateTime)  # Lease; a running job past it is handed to another worker
+    last_error = db.Column(db.Text)
+
+    # Workers look for due jobs by status and run_at
+    __table_args__ = (db.Index('ix_job_status_run_at', 'status', 'run_at'),)
+
+    def __repr__(self):
+        return f"Job('{self.name}', '{self.status}')"
@@ -0,0 +1,189 @@
+import hashlib  # Used to key per-account buckets without storing the email itself
+import os  # Used to resolve the on-disk store location
+import re  # Parses rates such as '10/minute'
+import threading  # Locks and per-thread connections
+import time  # Token refill clock
+from collections import OrderedDict  # LRU ordering for the in-process backend
+from functools import wraps
+from flask import current_app, request
+from werkzeug.exceptions import TooManyRequests
+from cache import sqlite_connection  # Per-thread connections to the local SQLite store shared by all workers
+
+# Seconds in each period a rate may be given per
+PERIODS = {'second': 1, 'minute': 60, 'hour': 3600, 'day': 86400}
+
+
+# Parse '10/minute' (or '10 per minute', '10/5minutes') into (capacity, tokens added per second)
+def parse_rate(rate):
+    match = re.fullmatch(r'\s*(\d+)\s*(?:/|per)\s*(\d*)\s*(second|minute|hour|day)s?\s*', rate)
+    if match is None:
+        raise ValueError(f"Invalid rate: {rate!r}")
+    count, multiple, period = int(match.group(1)), int(match.group(2) or 1), match.group(3)
+    if count == 0 or multiple == 0:
+        # A bucket that never refills would divide by zero when working out Retry-After
+        raise ValueError(f"Invalid rate: {rate!r} (use an empty value to turn a limit off)")
+    return count, count / (multiple * PERIODS[period])
+
+
+# Refill a bucket for the time since it was last updated, then take `cost` tokens if it holds enough.
+# Returns (allowed, tokens left, seconds until `cost` tokens are available).
+def _take(tokens, updated, now, capacity, refill, cost):
+    tokens = min(capacity, tokens + (now - updated) * refill)
+    if tokens >= cost:
+        return True, tokens - cost, 0.0
+    return False, tokens, (cost - tokens) / refill
+
+
+# Per-process buckets, bounded by count; least recently used buckets are dropped first (a dropped bucket is full)
+class MemoryBackend:
+    def __init__(self, max_keys=100000):
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, key, capacity, refill, cost=1):
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.pop(key, (capacity, now))
+            allowed, tokens, retry_after = _take(tokens, updated, now, capacity, refill, cost)
+            self._buckets[key] = (tokens, now)
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        return allowed, retry_after
+
+    def clear(self):
+        with self._lock:
+            self._buckets.clear()
+
+
+# SQLite-file buckets shared by every worker on a host, so limits hold however requests are spread.
+# Each take is one short IMMEDIATE transaction; rows for buckets that have refilled completely are pruned now and then.
+class SQLiteBackend:
+    PRUNE_EVERY = 1000
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._takes = 0
+        with self._connect() as conn:
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS rate_limit ('
+                'key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL, full_at REAL NOT NULL)'
+            )
+            conn.execute('CREATE INDEX IF NOT EXISTS ix_rate_limit_full_at ON rate_limit (full_at)')
+
+    def _connect(self):
+        return sqlite_connection(self._local, self.path)
+
+    def take(self, key, capacity, refill, cost=1):
+        now = time.time()  # Wall clock, since the rows are shared between processes
+        conn = self._connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute('SELECT tokens, updated FROM rate_limit WHERE key = ?', (key,)).fetchone()
+            tokens, updated = row if row is not None else (capacity, now)
+            allowed, tokens, retry_after = _take(tokens, updated, now, capacity, refill, cost)
+            conn.execute(
+                'INSERT OR REPLACE INTO rate_limit VALUES (?, ?, ?, ?)',
+                (key, tokens, now, now + (capacity - tokens) / refill),
+            )
+            self._takes += 1
+            if self._takes % self.PRUNE_EVERY == 0:
+                conn.execute('DELETE FROM rate_limit WHERE full_at < ?', (now,))
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        return allowed, retry_after
+
+    def clear(self):
+        self._connect().execute('DELETE FROM rate_limit')
+
+
+# Token-bucket rate limiting for expensive unauthenticated endpoints such as login and registration.
+# Views opt in with @rate_limiter.limit('login', account=...): each request takes a token from a bucket per
+# client IP and, when account() returns something (e.g. the submitted email), from a bucket per account, so
+# both a single noisy client and a distributed attack on one account are throttled. An empty bucket answers
+# 429 with Retry-After before the view runs, i.e. before any password hashing or database work.
+# Limits per endpoint and scope come from RATELIMITS, e.g. {'login': {'ip': '20/minute', 'account': '5/minute'}}.
+# Buckets live in a SQLite file shared by the workers on a host ('sqlite') or in each process ('memory').
+class RateLimiter:
+    def __init__(self, app=None):
+        self.backend = None
+        self.limits = {}
+        self.proxy_count = 0
+        self._lock = threading.Lock()
+        self.counts = {}  # (name, scope, outcome) -> requests, for /metrics
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        name = app.config.get('RATELIMIT_BACKEND', 'sqlite')
+        if not app.config.get('RATELIMIT_ENABLED', True) or name in (None, 'null', 'none'):
+            self.backend = None
+        elif name == 'memory':
+            self.backend = MemoryBackend(app.config.get('RATELIMIT_MAX_KEYS', 100000))
+        elif name == 'sqlite':
+            path = app.config.get('RATELIMIT_PATH') or os.path.join(app.instance_path, 'rate_limit.db')
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            self.backend = SQLiteBackend(path)
+        else:
+            raise ValueError(f"Unknown RATELIMIT_BACKEND: {name!r}")
+        self.limits = {
+            endpoint: {scope: parse_rate(rate) for scope, rate in scopes.items() if rate}
+            for endpoint, scopes in app.config.get('RATELIMITS', {}).items()
+        }
+        self.proxy_count = app.config.get('RATELIMIT_PROXY_COUNT', 0)
+        app.extensions['rate_limiter'] = self
+
+    # The client address, taken from X-Forwarded-For when the app runs behind proxy_count trusted proxies
+    def client_ip(self):
+        if self.proxy_count:
+            forwarded = [part.strip() for part in request.headers.get('X-Forwarded-For', '').split(',') if part.strip()]
+            if len(forwarded) >= self.proxy_count:
+                return forwarded[-self.proxy_count]
+        return request.remote_addr or 'unknown'
+
+    def _count(self, name, scope, outcome):
+        with self._lock:
+            key = (name, scope, outcome)
+            self.counts[key] = self.counts.get(key, 0) + 1
+
+    # Take a token from each bucket the request falls in; raises TooManyRequests if any of them is empty
+    def hit(self, name, account=None):
+        limits = self.limits.get(name)
+        if self.backend is None or not limits:
+            return
+        subjects = {'ip': self.client_ip()}
+        if account:
+            subjects['account'] = hashlib.sha1(account.strip().lower().encode('utf-8')).hexdigest()
+        for scope, subject in subjects.items():
+            if scope not in limits:
+                continue
+            capacity, refill = limits[scope]
+            allowed, retry_after = self.backend.take(f"{name}:{scope}:{subject}", capacity, refill)
+            if not allowed:
+                self._count(name, scope, 'limited')
+                current_app.logger.info('Rate limit %s/%s hit by %s', name, scope, subjects['ip'])
+                raise TooManyRequests(retry_after=max(1, int(retry_after + 0.999)))
+            self._count(name, scope, 'allowed')
+
+    # Decorator limiting a view; methods are the HTTP methods that count (e.g. only the POST of a form),
+    # and account() returns the account a request is aimed at, if any
+    def limit(self, name, methods=None, account=None):
+        def decorator(view):
+            @wraps(view)
+            def wrapper(*args, **kwargs):
+                if methods is None or request.method in methods:
+                    self.hit(name, account() if account else None)
+                return view(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def stats(self):
+        with self._lock:
+            return dict(self.counts)
+
+    def clear(self):
+        if self.backend is not None:
+            self.backend.clear()
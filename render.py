@@ -0,0 +1,124 @@
+import hashlib
+import html
+import re
+import click
+import markdown
+import nh3
+from flask.cli import AppGroup
+from sqlalchemy import event, or_
+from extensions import db, page_cache
+from model import Post
+
+# Bump whenever the output of render_markdown or make_excerpt changes; `flask posts render` then re-renders old rows
+RENDERER_VERSION = 1
+
+# Number of characters of plain text kept as a post's excerpt for feed cards
+EXCERPT_LENGTH = 300
+
+MARKDOWN_EXTENSIONS = ['fenced_code', 'tables', 'sane_lists']
+
+# Markup allowed to survive sanitizing; everything else, including raw <script> and event attributes, is dropped
+ALLOWED_TAGS = {
+    'a', 'abbr', 'b', 'blockquote', 'br', 'code', 'del', 'em', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'hr', 'i',
+    'img', 'li', 'ol', 'p', 'pre', 'strong', 'table', 'tbody', 'td', 'th', 'thead', 'tr', 'ul',
+}
+ALLOWED_ATTRIBUTES = {
+    'a': {'href', 'title'},
+    'abbr': {'title'},
+    'img': {'src', 'alt', 'title'},
+}
+ALLOWED_URL_SCHEMES = {'http', 'https', 'mailto'}
+
+
+# Convert Markdown source to sanitized HTML
+def render_markdown(source):
+    unsafe = markdown.markdown(source or '', extensions=MARKDOWN_EXTENSIONS, output_format='html')
+    return nh3.clean(
+        unsafe,
+        tags=ALLOWED_TAGS,
+        attributes=ALLOWED_ATTRIBUTES,
+        url_schemes=ALLOWED_URL_SCHEMES,
+        link_rel='noopener noreferrer nofollow',
+    )
+
+
+# Plain-text excerpt of rendered HTML, cut at EXCERPT_LENGTH characters
+def make_excerpt(rendered):
+    text = html.unescape(nh3.clean(rendered, tags=set()))
+    text = re.sub(r'\s+', ' ', text).strip()
+    if len(text) > EXCERPT_LENGTH:
+        text = text[:EXCERPT_LENGTH].rstrip() + '…'
+    return text
+
+
+def content_hash(source):
+    return hashlib.sha256((source or '').encode('utf-8')).hexdigest()
+
+
+# The stored rendering columns for a post body
+def rendered_columns(source):
+    content_html = render_markdown(source)
+    return {
+        'content_html': content_html,
+        'excerpt': make_excerpt(content_html),
+        'content_hash': content_hash(source),
+        'renderer_version': RENDERER_VERSION,
+    }
+
+
+# Fill in a post's rendering columns unless they are already current for its content; returns True if re-rendered
+def render_post(post, force=False):
+    if not force and post.renderer_version == RENDERER_VERSION and post.content_hash == content_hash(post.content):
+        return False
+    for column, value in rendered_columns(post.content).items():
+        setattr(post, column, value)
+    return True
+
+
+# Render when a post is written, so views only ever read the stored HTML
+@event.listens_for(Post, 'before_insert')
+@event.listens_for(Post, 'before_update')
+def _render_before_write(mapper, connection, target):
+    render_post(target)
+
+
+# Re-render posts rendered by an older renderer version (or never rendered), batch_size rows per transaction.
+# With everything=True every post is re-rendered.
+def render_stale(batch_size=200, everything=False, progress=None):
+    stale = or_(
+        Post.renderer_version.is_(None),
+        Post.renderer_version != RENDERER_VERSION,
+        Post.content_hash.is_(None),
+    )
+    last_id = 0
+    total = 0
+    while True:
+        query = db.session.query(Post).filter(Post.id > last_id)
+        if not everything:
+            query = query.filter(stale)
+        posts = query.order_by(Post.id).limit(batch_size).all()
+        if not posts:
+            break
+        for post in posts:
+            render_post(post, force=everything)
+        db.session.commit()
+        last_id = posts[-1].id
+        total += len(posts)
+        db.session.expunge_all()
+        if progress:
+            progress(total)
+    if total:
+        page_cache.clear()
+    return total
+
+
+# `flask posts ...` commands
+posts_cli = AppGroup('posts', help='Manage stored post renderings.')
+
+
+@posts_cli.command('render')
+@click.option('--batch-size', default=200, show_default=True, help='Posts rendered per transaction.')
+@click.option('--all', 'everything', is_flag=True, help='Re-render every post, not only stale ones.')
+def render_command(batch_size, everything):
+    total = render_stale(batch_size, everything, progress=lambda n: click.echo(f"Rendered {n} posts", err=True))
+    click.echo(f"Rendered {total} posts (renderer version {RENDERER_VERSION}).")
@@ -0,0 +1,253 @@
+import re  # Used to split search input into terms
+from collections import namedtuple
+import click
+from flask.cli import AppGroup
+from markupsafe import Markup, escape
+from sqlalchemy import DateTime, bindparam, event, inspect, text
+from extensions import db
+from model import Post
+
+# Markers placed around matched terms in snippets; replaced with <mark> after the snippet is HTML-escaped
+MATCH_START = '\ue000'
+MATCH_END = '\ue001'
+
+# Number of tokens of context returned in a snippet
+SNIPPET_TOKENS = 24
+
+# A page of search results and the cursor for the next page, or None on the last page
+SearchPage = namedtuple('SearchPage', ['results', 'next_cursor'])
+
+# A single search hit with its highlighted snippet
+SearchResult = namedtuple('SearchResult', ['id', 'title', 'date_posted', 'author_username', 'snippet'])
+
+
+# Create the full-text index table for the connection's database if it doesn't exist yet,
+# filling it from any posts already present
+def ensure_search_index(connection):
+    if connection.dialect.name == 'sqlite':
+        exists = connection.execute(
+            text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'post_search'")
+        ).first()
+        if not exists:
+            connection.execute(text(
+                "CREATE VIRTUAL TABLE post_search USING fts5(title, content, tokenize='porter unicode61')"
+            ))
+            # Rank title matches well above body matches
+            connection.execute(text("INSERT INTO post_search(post_search, rank) VALUES('rank', 'bm25(10.0, 1.0)')"))
+            connection.execute(text('INSERT INTO post_search (rowid, title, content) SELECT id, title, content FROM post'))
+            return True
+    elif connection.dialect.name == 'postgresql':
+        exists = connection.execute(text("SELECT to_regclass('post_search')")).scalar()
+        if not exists:
+            connection.execute(text(
+                'CREATE TABLE post_search ('
+                'post_id INTEGER PRIMARY KEY REFERENCES post (id) ON DELETE CASCADE, '
+                'document TSVECTOR NOT NULL)'
+            ))
+            connection.execute(text('CREATE INDEX ix_post_search_document ON post_search USING GIN (document)'))
+            connection.execute(text(
+                'INSERT INTO post_search (post_id, document) '
+                "SELECT id, setweight(to_tsvector('english', title), 'A') || setweight(to_tsvector('english', content), 'B') "
+                'FROM post'
+            ))
+            return True
+    return False
+
+
+# Add or replace the index entry for one post
+def index_post(connection, post_id, title, content):
+    if connection.dialect.name == 'sqlite':
+        connection.execute(text('DELETE FROM post_search WHERE rowid = :id'), {'id': post_id})
+        connection.execute(
+            text('INSERT INTO post_search (rowid, title, content) VALUES (:id, :title, :content)'),
+            {'id': post_id, 'title': title, 'content': content},
+        )
+    elif connection.dialect.name == 'postgresql':
+        connection.execute(
+            text(
+                'INSERT INTO post_search (post_id, document) VALUES (:id, '
+                "setweight(to_tsvector('english', :title), 'A') || setweight(to_tsvector('english', :content), 'B')) "
+                'ON CONFLICT (post_id) DO UPDATE SET document = EXCLUDED.document'
+            ),
+            {'id': post_id, 'title': title, 'content': content},
+        )
+
+
+# Remove the index entries for the given post ids
+def remove_posts(connection, post_ids):
+    post_ids = list(post_ids)
+    if not post_ids:
+        return
+    if connection.dialect.name == 'sqlite':
+        statement = text('DELETE FROM post_search WHERE rowid IN :ids')
+    elif connection.dialect.name == 'postgresql':
+        statement = text('DELETE FROM post_search WHERE post_id IN :ids')
+    else:
+        return
+    connection.execute(statement.bindparams(bindparam('ids', expanding=True)), {'ids': post_ids})
+
+
+# Create the index along with the post table, so databases made with plain db.create_all() can take writes
+@event.listens_for(Post.__table__, 'after_create')
+def _post_table_created(target, connection, **kw):
+    ensure_search_index(connection)
+
+
+# Remove the index entries for every post by the given authors, selecting the posts in the database
+# so that the statement binds only the author ids however many posts they wrote
+def remove_posts_by_authors(connection, user_ids):
+    user_ids = list(user_ids)
+    if not user_ids:
+        return
+    if connection.dialect.name == 'sqlite':
+        statement = text('DELETE FROM post_search WHERE rowid IN (SELECT id FROM post WHERE user_id IN :ids)')
+    elif connection.dialect.name == 'postgresql':
+        statement = text('DELETE FROM post_search WHERE post_id IN (SELECT id FROM post WHERE user_id IN :ids)')
+    else:
+        return
+    connection.execute(statement.bindparams(bindparam('ids', expanding=True)), {'ids': user_ids})
+
+
+# Keep the index in step with the post table from within the same transaction as the write
+@event.listens_for(Post, 'after_insert')
+def _post_inserted(mapper, connection, target):
+    index_post(connection, target.id, target.title, target.content)
+
+
+@event.listens_for(Post, 'after_update')
+def _post_updated(mapper, connection, target):
+    state = inspect(target)
+    if state.attrs.title.history.has_changes() or state.attrs.content.history.has_changes():
+        index_post(connection, target.id, target.title, target.content)
+
+
+@event.listens_for(Post, 'after_delete')
+def _post_deleted(mapper, connection, target):
+    remove_posts(connection, [target.id])
+
+
+# Turn free-form user input into an FTS5 query: every word must match, the last one as a prefix
+def _fts5_query(query):
+    terms = re.findall(r'\w+', query)
+    if not terms:
+        return None
+    quoted = [f'"{term}"' for term in terms]
+    quoted[-1] += '*'
+    return ' '.join(quoted)
+
+
+def encode_cursor(rank, post_id):
+    return f"{rank!r}_{post_id}"
+
+
+def decode_cursor(cursor):
+    rank, _, post_id = cursor.rpartition('_')
+    return float(rank), int(post_id)
+
+
+# HTML-escape a snippet from the database and wrap the matched terms in <mark>
+def _highlight(snippet):
+    return Markup(
+        str(escape(snippet or '')).replace(MATCH_START, '<mark>').replace(MATCH_END, '</mark>')
+    )
+
+
+# Ranked, highlighted full-text search over posts with keyset pagination on (rank, id)
+def search_posts(query, after=None, limit=20):
+    connection = db.session.connection()
+    params = {'limit': limit + 1, 'start': MATCH_START, 'end': MATCH_END}
+    if after:
+        params['rank'], params['after_id'] = decode_cursor(after)
+
+    if connection.dialect.name == 'sqlite':
+        params['query'] = _fts5_query(query)
+        if params['query'] is None:
+            return SearchPage([], None)
+        # bm25 ranks are negative, best match first
+        keyset = 'AND (post_search.rank > :rank OR (post_search.rank = :rank AND post_search.rowid > :after_id))' if after else ''
+        statement = text(
+            'SELECT post.id, post.title, post.date_posted, "user".username AS author_username, '
+            'post_search.rank AS rank, '
+            f'snippet(post_search, 1, :start, :end, \'…\', {SNIPPET_TOKENS}) AS snippet '
+            'FROM post_search JOIN post ON post.id = post_search.rowid JOIN "user" ON "user".id = post.user_id '
+            f'WHERE post_search MATCH :query {keyset} '
+            'ORDER BY post_search.rank, post_search.rowid LIMIT :limit'
+        )
+    elif connection.dialect.name == 'postgresql':
+        params['query'] = query
+        # Rank and paginate on the GIN index first, then build headlines only for the page being returned
+        keyset = 'AND (hits.rank < :rank OR (hits.rank = :rank AND hits.post_id > :after_id))' if after else ''
+        statement = text(
+            'SELECT post.id, post.title, post.date_posted, "user".username AS author_username, page.rank, '
+            'ts_headline(\'english\', post.content, page.tsq, '
+            f'\'StartSel=\' || :start || \', StopSel=\' || :end || \', MaxWords={SNIPPET_TOKENS}, MinWords=8\') AS snippet '
+            'FROM ('
+            '  SELECT hits.post_id, hits.rank, hits.tsq FROM ('
+            '    SELECT post_search.post_id, ts_rank_cd(post_search.document, tsq)::float8 AS rank, tsq '
+            "    FROM post_search, websearch_to_tsquery('english', :query) AS tsq "
+            '    WHERE post_search.document @@ tsq'
+            f'  ) AS hits WHERE true {keyset} '
+            '  ORDER BY hits.rank DESC, hits.post_id LIMIT :limit'
+            ') AS page '
+            'JOIN post ON post.id = page.post_id JOIN "user" ON "user".id = post.user_id '
+            'ORDER BY page.rank DESC, page.post_id'
+        )
+    else:
+        return SearchPage([], None)
+
+    rows = connection.execute(statement.columns(date_posted=DateTime), params).all()
+    results = [
+        SearchResult(row.id, row.title, row.date_posted, row.author_username, _highlight(row.snippet))
+        for row in rows[:limit]
+    ]
+    next_cursor = encode_cursor(rows[limit - 1].rank, rows[limit - 1].id) if len(rows) > limit else None
+    return SearchPage(results, next_cursor)
+
+
+# Rebuild the index from the post table in batches of batch_size, without loading the table into memory
+def reindex(batch_size=500, progress=None):
+    connection = db.session.connection()
+    ensure_search_index(connection)
+    if connection.dialect.name == 'sqlite':
+        connection.execute(text('DELETE FROM post_search'))
+    elif connection.dialect.name == 'postgresql':
+        connection.execute(text('TRUNCATE post_search'))
+    db.session.commit()
+
+    last_id = 0
+    total = 0
+    while True:
+        rows = (
+            db.session.query(Post.id, Post.title, Post.content)
+            .filter(Post.id > last_id)
+            .order_by(Post.id)
+            .limit(batch_size)
+            .all()
+        )
+        if not rows:
+            break
+        connection = db.session.connection()
+        for row in rows:
+            index_post(connection, row.id, row.title, row.content)
+        db.session.commit()
+        last_id = rows[-1].id
+        total += len(rows)
+        if progress:
+            progress(total)
+
+    connection = db.session.connection()
+    if connection.dialect.name == 'sqlite':
+        connection.execute(text("INSERT INTO post_search(post_search) VALUES('optimize')"))
+    db.session.commit()
+    return total
+
+
+# `flask search ...` commands
+search_cli = AppGroup('search', help='Manage the full-text search index.')
+
+
+@search_cli.command('reindex')
+@click.option('--batch-size', default=500, show_default=True, help='Posts indexed per transaction.')
+def reindex_command(batch_size):
+    total = reindex(batch_size, progress=lambda n: click.echo(f"Indexed {n} posts", err=True))
+    click.echo(f"Search index rebuilt: {total} posts.")
@@ -0,0 +1,81 @@
+# Production server: runs the app under gunicorn with several worker processes, each with a thread pool.
+#
+#   python -m serve                      # settings from the environment, see below
+#   python -m serve --workers 8 --threads 4 --bind 0.0.0.0:8000
+#
+# The app is built once in the master process (preload) and forked into the workers.
+# Send SIGHUP to the master for a graceful reload of the workers: new workers start before the old ones are
+# retired. Because the app is preloaded, picking up new code needs a full restart of the master.
+import argparse
+import multiprocessing
+import os
+from gunicorn.app.base import BaseApplication
+from app import create_app
+from extensions import db
+
+
+# Defaults read from the environment so that Docker and process managers can configure the server
+def default_options():
+    return {
+        'bind': os.environ.get('BIND', f"0.0.0.0:{os.environ.get('PORT', 5500)}"),
+        'workers': int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1)),
+        'threads': int(os.environ.get('WEB_THREADS', 4)),
+        'keepalive': int(os.environ.get('WEB_KEEPALIVE', 5)),
+        'timeout': int(os.environ.get('WEB_TIMEOUT', 30)),
+        'graceful_timeout': int(os.environ.get('WEB_GRACEFUL_TIMEOUT', 30)),
+        'max_requests': int(os.environ.get('WEB_MAX_REQUESTS', 0)),
+        'max_requests_jitter': int(os.environ.get('WEB_MAX_REQUESTS_JITTER', 0)),
+    }
+
+
+# Connections opened by the master must not be shared with forked workers
+def post_fork(server, worker):
+    with server.app.application.app_context():
+        for engine in db.engines.values():
+            engine.dispose(close=False)
+
+
+# Gunicorn application wrapping create_app()
+class BlogServer(BaseApplication):
+    def __init__(self, options, config=None):
+        self.options = options
+        self.config_name = config
+        self.application = None
+        super().__init__()
+
+    def load_config(self):
+        for key, value in self.options.items():
+            self.cfg.set(key, value)
+        self.cfg.set('worker_class', 'gthread')
+        self.cfg.set('preload_app', True)
+        self.cfg.set('post_fork', post_fork)
+        self.cfg.set('accesslog', '-')
+
+    def load(self):
+        if self.application is None:
+            self.application = create_app(self.config_name)
+        return self.application
+
+
+def main(argv=None):
+    defaults = default_options()
+    parser = argparse.ArgumentParser(prog='python -m serve')
+    parser.add_argument('--bind', default=defaults['bind'], help='address to listen on (BIND or PORT)')
+    parser.add_argument('--workers', type=int, default=defaults['workers'], help='worker processes (WEB_CONCURRENCY)')
+    parser.add_argument('--threads', type=int, default=defaults['threads'], help='threads per worker (WEB_THREADS)')
+    parser.add_argument('--keepalive', type=int, default=defaults['keepalive'], help='keep-alive seconds (WEB_KEEPALIVE)')
+    parser.add_argument('--timeout', type=int, default=defaults['timeout'], help='worker timeout seconds (WEB_TIMEOUT)')
+    parser.add_argument('--graceful-timeout', type=int, default=defaults['graceful_timeout'],
+                        help='seconds workers get to finish requests on reload or shutdown (WEB_GRACEFUL_TIMEOUT)')
+    parser.add_argument('--max-requests', type=int, default=defaults['max_requests'],
+                        help='recycle a worker after this many requests, 0 to disable (WEB_MAX_REQUESTS)')
+    parser.add_argument('--max-requests-jitter', type=int, default=defaults['max_requests_jitter'])
+    parser.add_argument('--config', default=None, help='configuration name, defaults to APP_ENV')
+    args = parser.parse_args(argv)
+
+    options = {key: value for key, value in vars(args).items() if key != 'config'}
+    BlogServer(options, args.config).run()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+import hashlib  # Used to derive the version stamp of a user record
+from collections import namedtuple
+from flask_login import UserMixin  # Provides is_authenticated, get_id and id-based equality
+from cache import TTLCache
+from extensions import db
+from model import User
+
+# The slim per-user record kept in the cache; version changes whenever the password or admin flag does
+UserRecord = namedtuple('UserRecord', ['id', 'username', 'is_admin', 'version'])
+
+
+# Version stamp for a user's password hash and permissions
+def user_version(password, is_admin):
+    return hashlib.sha1(f"{password}:{bool(is_admin)}".encode('utf-8')).hexdigest()[:16]
+
+
+# Stand-in for current_user built from a cached UserRecord.
+# The id, username and is_admin flag are answered from the record; any other attribute
+# (email, date_joined, posts, ...) loads the full ORM User once, on first use.
+class SessionUser(UserMixin):
+    def __init__(self, record):
+        self.id = record.id
+        self.username = record.username
+        self.is_admin = bool(record.is_admin)
+        self.version = record.version
+        self._orm_user = None
+
+    @property
+    def orm_user(self):
+        if self._orm_user is None:
+            self._orm_user = db.session.get(User, self.id)
+        return self._orm_user
+
+    def __getattr__(self, name):
+        # Only reached for attributes not set above
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return getattr(self.orm_user, name)
+
+    def __repr__(self):
+        return f"SessionUser('{self.username}')"
+
+
+# Bounded, TTL'd cache of UserRecords backing the Flask-Login user_loader.
+# The cache is per process, so entries are keyed by the user's change-marker token as well: invalidate() bumps
+# the marker, and every worker (and the job worker's writes) stops using the old record on its next request.
+class SessionUserCache:
+    def __init__(self, app=None):
+        self.cache = TTLCache()
+        self.markers = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.cache = TTLCache(
+            max_entries=app.config.get('USER_CACHE_MAX_ENTRIES', 4096),
+            ttl=app.config.get('USER_CACHE_TTL', 30),
+        )
+        self.markers = app.extensions.get('change_markers')
+        app.extensions['user_cache'] = self
+
+    def _key(self, user_id):
+        if self.markers is None:
+            return user_id, None
+        return user_id, self.markers.get(f"user:{user_id}")[0]
+
+    # Return a SessionUser for the id, reading only the slim columns from the database on a miss
+    def load(self, user_id):
+        key = self._key(user_id)
+        record = self.cache.get(key)
+        if record is None:
+            row = db.session.query(User.id, User.username, User.is_admin, User.password).filter_by(id=user_id).first()
+            if row is None:
+                return None
+            record = UserRecord(row.id, row.username, bool(row.is_admin), user_version(row.password, row.is_admin))
+            self.cache.set(key, record)
+        return SessionUser(record)
+
+    def invalidate(self, user_id):
+        self.cache.delete(self._key(user_id))
+        if self.markers is not None:
+            self.markers.bump(f"user:{user_id}")
+
+    def clear(self):
+        self.cache.clear()
+
+    def stats(self):
+        return self.cache.stats()
+
+# Initialize the SessionUserCache instance used by the Flask-Login user_loader
+user_cache = SessionUserCache()
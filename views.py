@@ -0,0 +1,405 @@
+from datetime import datetime
+from functools import wraps
+from flask import Blueprint, abort, current_app, flash, get_flashed_messages, jsonify, redirect, render_template, request, stream_template, url_for
+from flask_login import current_user, login_required, login_user, logout_user
+from flask_wtf import FlaskForm
+from flask_wtf.csrf import validate_csrf
+from sqlalchemy import text
+from sqlalchemy.exc import SQLAlchemyError
+from wtforms import SubmitField
+from wtforms.validators import ValidationError
+from extensions import db, login_manager, page_cache, password_hasher, rate_limiter, read_only
+from model import Post, User
+from hashing import HasherBusy
+from feed import get_feed_page
+from dashboard import dashboard_totals, signups_per_day, top_posters, user_page
+from admin_ops import BULK_ACTIONS, run_bulk_action
+from search import search_posts
+from export import exporter
+from jobs import job_queue
+from user_cache import user_cache
+from conditional import conditional
+
+# Blueprint holding all of the blog's routes; registered on the app by create_app()
+blog = Blueprint('blog', __name__)
+
+# Flask-WTF form for removing permissions
+class RemovePermissionsForm(FlaskForm):
+    submit = SubmitField('Remove Permissions')
+
+# Flask-Login user loader callback, served from the session-user cache
+@login_manager.user_loader
+def load_user(user_id):
+    return user_cache.load(int(user_id))
+
+# Reject the request when the password hashing pool is saturated, rather than queueing behind it
+@blog.app_errorhandler(HasherBusy)
+def hasher_busy(error):
+    return "The server is busy, please try again shortly.", 503, {'Retry-After': '1'}
+
+# Custom decorator to restrict access to admins only
+def admin_required(f):
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        if not current_user.is_admin:
+            abort(403)  # Forbidden access if the user is not an admin
+        return f(*args, **kwargs)
+    return decorated_function
+
+# Read the ?before= cursor and ?limit= page size for the feed, rejecting bad values with a 400
+def feed_page_from_request():
+    limit = request.args.get('limit', current_app.config['FEED_PAGE_SIZE'], type=int)
+    limit = max(1, min(limit, current_app.config['FEED_MAX_PAGE_SIZE']))
+    try:
+        return get_feed_page(before=request.args.get('before'), limit=limit)
+    except ValueError:
+        abort(400)
+
+# Drop cached feed pages (HTML and JSON) after a post is created, changed or removed, and refresh the static export
+def invalidate_feed_cache():
+    page_cache.invalidate('blog.home')
+    page_cache.invalidate('blog.api_posts')
+    exporter.schedule()
+
+# Drop cached state for users changed by a bulk action, and the pages of any posts it deleted
+def invalidate_bulk_chunk(user_ids, post_ids):
+    for user_id in user_ids:
+        user_cache.invalidate(user_id)
+    for post_id in post_ids:
+        page_cache.invalidate('blog.post', post_id=post_id)
+    if post_ids:
+        exporter.schedule()
+
+# Readiness probe for load balancers and orchestrators: checks that a pooled database connection works
+@blog.route('/healthz')
+def healthz():
+    try:
+        db.session.execute(text('SELECT 1'))
+    except SQLAlchemyError:
+        db.session.rollback()
+        return jsonify(status='unavailable', database='error'), 503
+    return jsonify(status='ok', database='ok', pool=db.engine.pool.status())
+
+# Route for the home page, displays one page of the feed (newest posts first)
+@blog.route('/')
+@blog.route('/home')
+@read_only
+@page_cache.cached()
+@conditional()
+def home():
+    page = feed_page_from_request()
+    next_url = url_for('blog.home', before=page.next_cursor, limit=request.args.get('limit')) if page.next_cursor else None
+    return render_template('home.html', posts=page.posts, next_url=next_url)
+
+# JSON feed API, paginated with the same cursor as the home page
+@blog.route('/api/posts')
+@read_only
+@page_cache.cached()
+@conditional()
+def api_posts():
+    page = feed_page_from_request()
+    return jsonify(
+        posts=[
+            {
+                'id': post.id,
+                'title': post.title,
+                'date_posted': post.date_posted.isoformat(),
+                'excerpt': post.excerpt,
+                'author': post.author_username,
+                'url': url_for('blog.post', post_id=post.id),
+            }
+            for post in page.posts
+        ],
+        next=page.next_cursor,
+    )
+
+# Route for full-text search over posts, ranked and paginated with ?q= and ?after=
+@blog.route('/search')
+@read_only
+def search():
+    query = request.args.get('q', '').strip()
+    limit = request.args.get('limit', current_app.config['FEED_PAGE_SIZE'], type=int)
+    limit = max(1, min(limit, current_app.config['FEED_MAX_PAGE_SIZE']))
+    results, next_url = [], None
+    if query:
+        try:
+            page = search_posts(query, after=request.args.get('after'), limit=limit)
+        except ValueError:
+            abort(400)
+        results = page.results
+        if page.next_cursor:
+            next_url = url_for('blog.search', q=query, after=page.next_cursor, limit=request.args.get('limit'))
+    return render_template('search.html', title='Search', query=query, results=results, next_url=next_url)
+
+# Route to promote a user to admin (requires admin privileges)
+@blog.route('/make-admin/<int:user_id>')
+@login_required
+@admin_required
+def make_admin(user_id):
+    user = User.query.get_or_404(user_id)
+    user.is_admin = True
+    db.session.commit()
+    user_cache.invalidate(user.id)
+    flash(f'{user.username} has been promoted to admin!', 'success')
+    return redirect(url_for('blog.admin_dashboard'))
+
+# Route for user registration
+@blog.route('/register', methods=['GET', 'POST'])
+@rate_limiter.limit('register', methods=('POST',))
+def register():
+    if current_user.is_authenticated:
+        return redirect(url_for('blog.home'))
+    if request.method == 'POST':
+        username = request.form.get('username')
+        email = request.form.get('email')
+        password = request.form.get('password')
+        hashed_password = password_hasher.hash(password)
+        user = User(username=username, email=email, password=hashed_password)
+        db.session.add(user)
+        db.session.commit()
+        flash('Your account has been created! You are now able to log in', 'success')
+        return redirect(url_for('blog.login'))
+    return render_template('register.html')
+
+# Route for user login
+@blog.route('/login', methods=['GET', 'POST'])
+@rate_limiter.limit('login', methods=('POST',), account=lambda: request.form.get('email'))
+def login():
+    if current_user.is_authenticated:
+        return redirect(url_for('blog.home'))
+    if request.method == 'POST':
+        email = request.form.get('email')
+        password = request.form.get('password')
+        user = User.query.filter_by(email=email).first()
+        if user and password_hasher.check(user.password, password):
+            # Transparently upgrade hashes made at an outdated cost factor
+            if password_hasher.needs_rehash(user.password):
+                user.password = password_hasher.hash(password)
+                db.session.commit()
+                user_cache.invalidate(user.id)
+            login_user(user)
+            next_page = request.args.get('next')
+            return redirect(next_page) if next_page else redirect(url_for('blog.home'))
+        else:
+            flash('Login Unsuccessful. Please check email and password', 'danger')
+    return render_template('login.html')
+
+# Route to log out the user
+@blog.route('/logout')
+def logout():
+    logout_user()
+    return redirect(url_for('blog.home'))
+
+# Admin dashboard route (requires admin privileges)
+@blog.route('/admin_dashboard')
+@login_required
+@admin_required
+@read_only
+def admin_dashboard():
+    form = RemovePermissionsForm()
+    prefix = request.args.get('q', '').strip()
+    limit = current_app.config['ADMIN_PAGE_SIZE']
+    # Pop pending flash messages now: the session is saved with the headers, before base.html gets to read them.
+    # Flask keeps them on the request, so the template's get_flashed_messages() still shows them.
+    get_flashed_messages(with_categories=True)
+    # The user lists are read lazily while the template streams, so the page starts arriving before they finish
+    return stream_template(
+        'admin_dashboard.html',
+        form=form,
+        query=prefix,
+        totals=dashboard_totals(),
+        top_posters=top_posters(),
+        signups=signups_per_day(),
+        users_with_permissions=user_page(True, prefix, request.args.get('admins_after'), limit),
+        users_without_permissions=user_page(False, prefix, request.args.get('users_after'), limit),
+    )
+
+# Route to display the user's account page
+@blog.route('/account')
+@login_required
+def account():
+    return render_template('account.html')
+
+# Route to update the user's account information
+@blog.route('/account/update/<int:user_id>', methods=['GET', 'POST'])
+@login_required
+def update_account(user_id):
+    user = User.query.get_or_404(user_id)
+    if user != current_user:
+        abort(403)
+    if request.method == 'POST':
+        username_changed = user.username != request.form['username']
+        user.username = request.form['username']
+        user.email = request.form['email']
+        if request.form['password']:  # If a new password is provided, update it
+            user.password = password_hasher.hash(request.form['password'])
+        if username_changed:
+            # Their posts now display differently, so they count as updated (for the static export)
+            db.session.query(Post).filter_by(user_id=user.id).update(
+                {Post.date_updated: datetime.utcnow()}, synchronize_session=False)
+        db.session.commit()
+        user_cache.invalidate(user.id)
+        # The author name appears on the feed and on each of the user's posts
+        if username_changed:
+            invalidate_feed_cache()
+            for post_id, in db.session.query(Post.id).filter_by(user_id=user.id):
+                page_cache.invalidate('blog.post', post_id=post_id)
+        flash('Your account has been updated!', 'success')
+        return redirect(url_for('blog.account'))
+    return render_template('update_account.html', user=user)
+
+# Route to create a new post (requires login)
+@blog.route('/post/new', methods=['GET','POST'])
+@login_required
+def new_post():
+    if request.method == 'POST':
+        title = request.form.get('title')
+        content = request.form.get('content')
+        post = Post(title=title, content=content, user_id=current_user.id)
+        try:
+            db.session.add(post)
+            db.session.commit()
+            invalidate_feed_cache()
+            flash('Your post has been created!', 'success')
+            return redirect(url_for('blog.new_post'))
+        except Exception as e:
+            db.session.rollback()
+            error_str = str(e.__dict__['orig'])  # Get the original error message
+            flash(f'There was an issue creating your post: {error_str}', 'danger')
+    return render_template('create_post.html', title='New Post')
+
+# Route to view a specific post by ID
+@blog.route('/post/<int:post_id>')
+@read_only
+@page_cache.cached()
+@conditional()
+def post(post_id):
+    post = Post.query.get_or_404(post_id)
+    return render_template('view_post.html', title=post.title, post=post)
+
+# Route to update a post (requires login)
+@blog.route('/post/<int:post_id>/update', methods=['GET', 'POST'])
+@login_required
+def update_post(post_id):
+    post = Post.query.get_or_404(post_id)
+    if post.author != current_user:
+        abort(403)
+    if request.method == 'POST':
+        post.title = request.form.get('title')
+        post.content = request.form.get('content')
+        db.session.commit()
+        invalidate_feed_cache()
+        page_cache.invalidate('blog.post', post_id=post.id)
+        flash('Your post has been updated!', 'success')
+        return redirect(url_for('blog.post', post_id=post.id))
+    return render_template('edit_post.html', title='Update Post', post=post)
+
+# Route to add a test user (for testing purposes)
+@blog.route('/add_test_user')
+@rate_limiter.limit('add_test_user')
+def add_test_user():
+    test_user = User(username='testuser', email='testuser@example.com', password=password_hasher.hash('password'))
+    db.session.add(test_user)
+    db.session.commit()
+    return "Test user added!"
+
+# Route to delete a user (requires admin privileges)
+@blog.route('/delete-user/<int:user_id>')
+@login_required
+@admin_required
+def delete_user(user_id):
+    user = User.query.get_or_404(user_id)
+    # The key covers the join date too, since SQLite may hand a deleted user's id to a new account
+    job = job_queue.enqueue(
+        'delete_user', {'user_id': user.id}, key=f"delete_user:{user.id}:{user.date_joined.isoformat()}"
+    )
+    if job is None:
+        flash('User has been deleted!', 'success')
+    elif job.status in ('queued', 'running'):
+        flash('User will be deleted shortly.', 'success')
+    else:
+        # The job for this key already finished without removing the user; nothing new was queued
+        flash(f'Deleting {user.username} already ran (job {job.id}) and left the account in place.', 'danger')
+    return redirect(url_for('blog.admin_dashboard'))
+
+# Background job behind delete_user: deletes the user and their posts with set-based statements rather than
+# through the ORM relationship. Running it again for a user who is already gone does nothing.
+@job_queue.task('delete_user')
+def delete_user_job(user_id):
+    summary = run_bulk_action('delete', ids=[user_id], on_chunk=invalidate_bulk_chunk)
+    if summary['users_affected']:
+        invalidate_feed_cache()
+
+# Route to promote, demote or delete many users at once (requires admin privileges).
+# Accepts a JSON body or a form: action ('promote', 'demote' or 'delete') plus either a list of ids or filters
+# (prefix, is_admin, joined_before). The acting admin is never included. Returns a summary of rows affected.
+# The form carries the dashboard's CSRF token; JSON clients must send it in an X-CSRFToken header, which a
+# cross-site page cannot set, since the session cookie alone would let it trigger a mass delete.
+@blog.route('/admin/users/bulk', methods=['POST'])
+@login_required
+@admin_required
+def bulk_users():
+    if current_app.config.get('WTF_CSRF_ENABLED', True):
+        token = request.headers.get('X-CSRFToken') if request.is_json else request.form.get('csrf_token')
+        try:
+            validate_csrf(token)
+        except ValidationError:
+            abort(400)
+    if request.is_json:
+        data = request.get_json(silent=True)
+        if not isinstance(data, dict):
+            abort(400)
+        action, ids, filters = data.get('action'), data.get('ids'), data.get('filter') or {}
+    else:
+        action = request.form.get('action')
+        ids = request.form.getlist('ids') or None
+        filters = {
+            'prefix': request.form.get('prefix'),
+            'is_admin': {'true': True, 'false': False}.get(request.form.get('is_admin', '').lower()),
+            'joined_before': request.form.get('joined_before'),
+        }
+    if action not in BULK_ACTIONS:
+        abort(400)
+    try:
+        summary = run_bulk_action(
+            action,
+            ids=ids,
+            filters=filters,
+            chunk_size=current_app.config['BULK_CHUNK_SIZE'],
+            exclude_id=current_user.id,
+            on_chunk=invalidate_bulk_chunk,
+        )
+    except ValueError:
+        abort(400)
+    if action == 'delete' and summary['posts_deleted']:
+        invalidate_feed_cache()
+    if request.is_json:
+        return jsonify(summary)
+    flash(f"{action.capitalize()}: {summary['users_affected']} users, {summary['posts_deleted']} posts deleted "
+          f"in {summary['elapsed_ms']} ms.", 'success')
+    return redirect(url_for('blog.admin_dashboard'))
+
+# Route to remove admin permissions from a user (requires admin privileges)
+@blog.route('/remove_permissions/<int:user_id>', methods=['POST'])
+@login_required
+@admin_required
+def remove_permissions(user_id):
+    user = User.query.get_or_404(user_id)
+    user.is_admin = False
+    db.session.commit()
+    user_cache.invalidate(user.id)
+    return redirect(url_for('blog.admin_dashboard'))
+
+# Route to delete a post (requires login)
+@blog.route('/post/<int:post_id>/delete', methods=['POST'])
+@login_required
+def delete_post(post_id):
+    post = Post.query.get_or_404(post_id)
+    if post.author != current_user:
+        abort(403)
+    db.session.delete(post)
+    db.session.commit()
+    invalidate_feed_cache()
+    page_cache.invalidate('blog.post', post_id=post_id)
+    flash('Your post has been deleted!', 'success')
+    return redirect(url_for('blog.home'))